@@ -13,7 +13,7 @@
 # of Hazus. Basic flow:
 #	For each flood depth grid specified by the user:
 #		Determine depth of flooding at the UDF point.
-#		Process, record-by-record:
+#		Process, for the whole table at once:
 #			building/content/inventory damage based on the adjusted flood depth, the type of building, using the look-up tables.
 # 			Using the building loss ratio, calculates debris and building repair time.
 #
@@ -61,21 +61,269 @@
 # ---------------------------------------------------------------------------
 
 # Variations between systems; some import these by default, others don't. Be explicit.
-import os,csv,arcpy,sys,time,math,traceback,shutil,datetime
+import os,arcpy,sys,time,traceback,datetime,shutil,tempfile
+import multiprocessing
+import numpy as np	# Ships with ArcGIS; used for the bulk (whole-table) calculations
+try:
+	from concurrent import futures	# Python 3 (ArcGIS Pro) only. Used to process a depth grid's records in parallel
+except ImportError:
+	futures = None
+from arcpy import env
+from arcpy.sa import *	# The license itself is checked out in flood_damage, not on import
+
+# The UDF field names, the look-up tables and the loss calculation are in hazus_flood_kernel.py, next to this script.
+# It does not import arcpy, so the worker processes that calculate a chunk of records load it rather than this script.
+# If your UDF Naming Convention differs from the Hazus namings, change the names there.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from hazus_flood_kernel import *
+from hazus_flood_kernel import _compute_rows, _strip_codes, _load_luts, _compute_losses
 
 # Overwrite existing outputs if there. Not likely, given the output file gdb naming convention.
 arcpy.env.overwriteOutput = True
 
-# Spatial Analyst Checkout. Check it back in at the end.
-if arcpy.CheckExtension("Spatial") == "Available":
-	arcpy.AddMessage("Checking out Spatial Analyst Extension")
-	arcpy.CheckOutExtension("Spatial")
-	from arcpy import env
-	from arcpy.sa import *
-else:
-	arcpy.AddError("Unable to get spatial analyst extension")
-	arcpy.AddMessage(arcpy.GetMessages(0))
-	sys.exit(2)
+# Fewest records per chunk when the loss calculation for one depth grid is split over worker processes.
+# Below this, starting a worker (which loads the LUTs itself) costs more than the chunk takes to process.
+ROW_CHUNK_MIN = 50000
+
+#########################################################################################################
+# Pass a message on to ArcGIS; kind is 'Message', 'Warning' or 'Error'. ArcGIS messages sent from a worker
+# process never reach the tool, so there (out is a list) the message is kept in out, for flood_damage to pass on.
+#########################################################################################################
+def _add_message(out, kind, msg):
+	if out is None:
+		getattr(arcpy, 'Add' + kind)(msg)
+	else:
+		out.append((kind, msg))
+
+#########################################################################################################
+# Pass collected messages on to ArcGIS, one call each for the warnings and the errors, and empty the lists.
+# Every ArcGIS message is a round trip to the geoprocessing framework, so a QC-heavy run sends them in bulk.
+#########################################################################################################
+def _flush_messages(warnings, errors, out=None):
+	if warnings:
+		_add_message(out, 'Warning', "\n".join(warnings))
+		del warnings[:]
+	if errors:
+		_add_message(out, 'Error', "\n".join(errors))
+		del errors[:]
+
+#########################################################################################################
+# Process one depth grid: extract it to the UDF points, then calculate the damage for all records at once.
+# Runs in the script's own process, or in a worker process (see _grid_worker), writing to a geodatabase of its own.
+#   flags = the QC_Warning setting and which optional UDF fields are present; see flood_damage.
+#			row_workers, if given, is the number of worker processes the records may be spread over.
+#   luts  = the tables from _load_luts. If not given, they are loaded from LUT_Dir
+#   sample = (table, ID field, column) holding this grid's values from the one Sample call over all grids
+#			(see flood_damage). If not given, the grid is extracted to the UDF points here.
+#   out   = in a worker process, the list its ArcGIS messages are kept in; see _add_message
+# Returns the Results feature class and the number of records processed.
+#########################################################################################################
+def _process_one_grid(dgp, UDFOrig, Resultsfgdb, LUT_Dir, flags, luts=None, sample=None, out=None):
+	if luts is None:
+		luts = _load_luts(LUT_Dir)
+	iecon_by_occ		= luts['iecon_by_occ']
+
+	CoastalZoneSupplied	= flags['CoastalZoneSupplied']
+	ubddf				= flags['ubddf']
+	ucddf				= flags['ucddf']
+	uiddf				= flags['uiddf']
+	uccost				= flags['uccost']
+	uicost				= flags['uicost']
+	UDFRoot	 			= os.path.basename(UDFOrig)
+
+	_add_message(out, "Message", " ")    # A formatting step to improve readability of output)
+	_add_message(out, "Message", "Querying depth grid " + dgp)
+
+	# Set up the Results file. Extract grid to points, add needed fields, adjust for First Floor Height.
+	# Depth_in_Struc:  The adjusted flood depth
+	# flExp:   A simple 1/0 statement: is the UDF in the specified floodplain or is it not?
+	# SOID = SpecificOccupId.  A conversion of the OccupancyClass, FoundationType, and NumStories fields into a 4 to 5 character string for lookup.
+	# BDDF_ID = the particular Depth Damage Function ID used for that record
+	# BldgDmgPct = Loss Ratio for Building
+	# BldgLossUSD = Estimated Building Loss in US$  (some fraction of the user-specified Cost)
+	#
+	# Need to strip out any periods in the depth grid file name, say, "depth100.tif", as periods are COMPLETELY UNACCEPTABLE in fgdb feature class naming
+	# And if an input shapefile is specified, drop the *.shp extension. So a Texas Two Step to get a clean name
+	y = os.path.split(dgp)[1]
+	x = UDFRoot.split('.')[0] + "_" + y.split('.')[0]
+	ResultsFile = os.path.join(Resultsfgdb,x)
+	_add_message(out, "Message", "Writing results to " + ResultsFile)
+	gridroot = y    #  Put into an attribute in the Results file. Redundant, but handy when appending multiple results files together.
+
+	# Some research should go into INTERPOLATE versus NONE in the next function.
+	# A cursory peek suggested Hazus-MH Flood does 'NONE' (it had a better match).
+	# So to better match to the Hazus-MH Flood results, we (for now) choose 'NONE'.
+	if sample is None:
+		ExtractValuesToPoints(UDFOrig, dgp, ResultsFile, "NONE", "VALUE_ONLY")
+		# Change name of the generic RASTERVALU to Depth_Grid
+		arcpy.AlterField_management(ResultsFile,"RASTERVALU",Depth_Grid,Depth_Grid)
+	else:
+		# Grid already sampled (NEAREST, the Sample equivalent of 'NONE'): copy the UDF and join this grid's column on
+		sample_tbl, sample_id, sample_col = sample
+		arcpy.CopyFeatures_management(UDFOrig, ResultsFile)
+		arcpy.JoinField_management(ResultsFile, UserDefinedFltyId, sample_tbl, sample_id, [sample_col])
+		arcpy.AlterField_management(ResultsFile, sample_col, Depth_Grid, Depth_Grid)
+
+	###################################################
+	# Depth Adjustments and Cost Basis - done for the whole table at once
+	###################################################
+	# These columns are pure arithmetic on the UDF attributes, so there is no need to push them through
+	# a per-record cursor. Pull the needed attributes into a NumPy array, do the math on entire columns,
+	# and write the results back with a single ExtendTable call (which also creates the fields).
+	#
+	# Adjust Depth-in-Structure, given the First Floor Height. This will produce the occasional negative value. That is OK
+	# NOTE: Some users suggest that Coastal Flooding should be adjusted by an additional 1.0 foot, because in coastal flooding,
+	# FFH should be considered to be at the freeboard.
+	# However, we confirmed with the Hazus coding team that the Hazus-MH Flood model does NO such adjustment
+	# So for now, we do not do ANY FFH adjustment
+	#
+	# Note this simple calculation varies with the Hazus-MH flood model implementation that rounds FFH to the nearest 0.5 foot level
+	# (which will produce minor differences in the loss ratio calculation).
+	# We maintain the script implements the methods more cleanly. There was no compelling technical reason for
+	# the Hazus-MH flood model to round to the nearest 0.5 foot.
+	oidName = arcpy.Describe(ResultsFile).OIDFieldName
+	bulk_fields = [oidName, UserDefinedFltyId, Depth_Grid, FirstFloorHt, OccupancyClass, FoundationType, NumStories, Cost, Area]
+	# NumPy has no Null. Null raster values become -9999 (the same value some depth grid formats return anyway),
+	# Null user-supplied costs become -1, the 'use the default' flag, and Null codes become ''.
+	bulk_nulls = {Depth_Grid: -9999}
+	if uccost:
+		bulk_fields.append(ContentCost)
+		bulk_nulls[ContentCost] = -1
+	if uicost:
+		bulk_fields.append(InvCost)
+		bulk_nulls[InvCost] = -1
+	# Optional codes: only read when present in the input
+	for present, field in ((CoastalZoneSupplied, flC), (ubddf, BldgDamageFnID), (ucddf, ContDamageFnId), (uiddf, InvDamageFnId)):
+		if present:
+			bulk_fields.append(field)
+			bulk_nulls[field] = ''
+	udf = arcpy.da.TableToNumPyArray(ResultsFile, bulk_fields, null_value=bulk_nulls)
+	nrec = len(udf)
+
+	OC_all = _strip_codes(udf[OccupancyClass])	# Occupancy Class sometimes has trailing spaces, due to Hazus processing quirks.
+
+	# Encode the string-valued inputs as numbers once, so the kernel only sees numeric arrays.
+	# Content Cost default multiplier depends on OccupancyClass, per Hazus-MH Flood Technical Manual table
+	# One dictionary lookup per distinct OccupancyClass, then spread to all records
+	OC_unique, OC_index = np.unique(OC_all, return_inverse=True)
+	CMult = np.array([CMULT_BY_OC.get(oc, 0.0) for oc in OC_unique])[OC_index]
+	OWDI = np.array([oc in Inventory_List for oc in OC_unique], dtype=bool)[OC_index]
+	# Inventory economic parameters
+	econ = np.array([iecon_by_occ.get(oc, (0.0, 0.0)) for oc in OC_unique]).reshape(-1, 2)
+	GrossSales = econ[OC_index, 0]
+	BusinessInv = econ[OC_index, 1]
+	nocost = np.full(nrec, -1.0)
+	depth_all, exposed, ccost_all, icost_all = _compute_rows(
+		udf[Depth_Grid].astype(np.float64), udf[FirstFloorHt].astype(np.float64), udf[Cost].astype(np.float64),
+		udf[ContentCost].astype(np.float64) if uccost else nocost, udf[InvCost].astype(np.float64) if uicost else nocost,
+		udf[Area].astype(np.float64), CMult, OWDI, GrossSales, BusinessInv)
+
+	# The bulk results, at full precision for the loss calculation below
+	bulk = np.empty(nrec, dtype=[("UDF_OID", np.int32), (Depth_in_Struc, np.float64), (flExp, np.int16),
+		(ContentCostUSD, np.float64), (InventoryCostUSD, np.float64)])
+	bulk["UDF_OID"] = udf[oidName]
+	bulk[Depth_in_Struc] = depth_all
+	bulk[flExp] = exposed	# A simple 1/0 statement: is the UDF in the specified floodplain or is it not?
+	bulk[ContentCostUSD] = ccost_all
+	bulk[InventoryCostUSD] = icost_all
+	del depth_all, exposed, ccost_all, icost_all
+	# Write them with the stored field types: FLOAT depth, LONG dollars (rounded, as setValue did).
+	# Depth_in_Struc is set to Null for unexposed structures once the loss results are written.
+	stored = np.empty(nrec, dtype=[("UDF_OID", np.int32), (Depth_in_Struc, np.float32), (flExp, np.int16),
+		(ContentCostUSD, np.int32), (InventoryCostUSD, np.int32)])
+	for field in stored.dtype.names:
+		stored[field] = np.rint(bulk[field]) if field in (ContentCostUSD, InventoryCostUSD) else bulk[field]
+	arcpy.da.ExtendTable(ResultsFile, oidName, stored, "UDF_OID")
+	del stored
+
+	###################################################
+	# Building, Content, Inventory Losses, Debris and Restoration Time - also for the whole table at once
+	###################################################
+	_add_message(out, "Message", "Calculating losses for depth grid " + dgp)
+	counter = nrec
+	# Records are independent of each other. For a large UDF, spread the records over worker processes in
+	# contiguous chunks (see flood_damage). The workers only calculate; their messages come back with the results.
+	nchunks = min(flags.get('row_workers', 1), nrec // ROW_CHUNK_MIN) if futures is not None else 1
+	if nchunks > 1:
+		_add_message(out, "Message", "Splitting the " + str(nrec) + " records into " + str(nchunks) + " chunks, processed in parallel")
+		bounds = np.linspace(0, nrec, nchunks + 1).astype(int)
+		first = bounds[:-1].tolist()
+		last = bounds[1:].tolist()
+		with futures.ProcessPoolExecutor(max_workers=nchunks) as ex:
+			parts = list(ex.map(_compute_losses, [udf[a:b] for a, b in zip(first, last)], [bulk[a:b] for a, b in zip(first, last)],
+				[LUT_Dir]*nchunks, [flags]*nchunks, [None]*nchunks, first))
+		results = np.concatenate([part[0] for part in parts])
+		warnings = [msg for part in parts for msg in part[1]]
+		errors = [msg for part in parts for msg in part[2]]
+		del parts
+	else:
+		results, warnings, errors = _compute_losses(udf, bulk, LUT_Dir, flags, luts)
+	_flush_messages(warnings, errors, out)
+
+	# When running multiple grids, sensitivity tests, etc, adding the gridname makes it easier to sort upon an appended dataset
+	results[GridName] = gridroot
+	del udf, bulk
+
+	# Write all output fields in one go; ExtendTable creates them with the types given in RESULT_DTYPE
+	arcpy.da.ExtendTable(ResultsFile, oidName, results, "UDF_OID")
+	del results
+
+	# NumPy has no Null. For the unexposed structures, set Depth_in_Struc and the Debris to Null,
+	# emphasizing the point is not exposed. Makes SummaryStats more straightforward
+	nullfields = [Depth_in_Struc, Debris_Fin, Debris_Struc, Debris_Found, Debris_Tot]
+	nullrow = [None] * len(nullfields)	# The same for every record; built once, outside the loop
+	# Field-list arcpy.da cursor: each record is updated with one tuple, and the with block releases the lock
+	with arcpy.da.UpdateCursor(ResultsFile, nullfields, arcpy.AddFieldDelimiters(ResultsFile, flExp) + " = 0") as cursor:
+		updateRow = cursor.updateRow
+		for row in cursor:
+			updateRow(nullrow)
+
+	_add_message(out, "Message", "Total records processed: " + str(counter))
+
+	return ResultsFile, counter
+
+#########################################################################################################
+# One depth grid in a worker process (see flood_damage). A file geodatabase does not take concurrent writers, so
+# the grid's Results feature class goes into a geodatabase of its own, GridN.gdb in ScratchDir, for flood_damage
+# to copy into the Results geodatabase. The process checks out Spatial Analyst for itself.
+# Returns the Results feature class, the number of records processed, and the ArcGIS messages, as (kind, message).
+# A HazusLookupError is passed on with the messages up to the failure in its messages attribute.
+#########################################################################################################
+def _grid_worker(index, dgp, UDFOrig, ScratchDir, LUT_Dir, flags, sample):
+	out = []
+	if arcpy.CheckOutExtension("Spatial") != "CheckedOut":
+		raise RuntimeError("Unable to get spatial analyst extension for depth grid " + dgp)
+	try:
+		arcpy.CreateFileGDB_management(ScratchDir, "Grid" + str(index))
+		ResultsFile, counter = _process_one_grid(dgp, UDFOrig, os.path.join(ScratchDir, "Grid" + str(index) + ".gdb"),
+			LUT_Dir, flags, None, sample, out)
+	except HazusLookupError as e:
+		e.messages = out
+		raise
+	finally:
+		arcpy.CheckInExtension("Spatial")
+	return ResultsFile, counter, out
+
+#########################################################################################################
+# The fields of the Sample output table (see flood_damage), picked by name rather than by position: the value
+# field of each depth grid, named after the grid's file name (with or without its extension, made a valid field
+# name), and the location ID field, the one left once those and the X and Y coordinates are set aside.
+# Returns (ID field, [value field per grid]), or None if they cannot be told apart.
+#########################################################################################################
+def _sample_fields(sample_tbl, DGrids):
+	gdb = os.path.dirname(sample_tbl)
+	names = dict((fld.name.lower(), fld.name) for fld in arcpy.ListFields(sample_tbl) if fld.type not in ('OID', 'Geometry'))
+	cols = []
+	for dgp in DGrids:
+		base = os.path.basename(dgp)
+		found = set(arcpy.ValidateFieldName(b, gdb).lower() for b in (base, os.path.splitext(base)[0])) & set(names)
+		if len(found) != 1:
+			return None
+		cols.append(found.pop())
+	ids = [n for n in names if n not in ('x', 'y') and n not in cols]
+	if len(ids) != 1 or len(set(cols)) != len(cols):
+		return None
+	return names[ids[0]], [names[n] for n in cols]
 
 #########################################################################################################
 # Main function. Five parameters See end for main procedure.
@@ -88,6 +336,15 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning):
 	# DepthGrids = one or more flood depth grids
 	# QC_Warning = Boolean, report on informative inconsistency observations if selected, otherwise suppress them
 
+	# Spatial Analyst Checkout. Check it back in at the end.
+	if arcpy.CheckExtension("Spatial") != "Available":
+		arcpy.AddError("Unable to get spatial analyst extension")
+		arcpy.AddMessage(arcpy.GetMessages(0))
+		sys.exit(2)
+	arcpy.AddMessage("Checking out Spatial Analyst Extension")
+	arcpy.CheckOutExtension("Spatial")
+
+	ScratchDir = None	# Intermediate tables, see below; removed however the run ends
 	try:
 		arcpy.AddMessage("DOGAMI Hazus Flood UDF loss estimation script, version 3.2, using Flood DDFs from Hazus-MH 4.0")
 		# ArcToolBox quirk with a Boolean expression. Argument is passed as a true/false string. Convert to a Boolean
@@ -96,102 +353,6 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning):
 		# Measure script performance
 		start_time = time.time()
 
-		#########################################################################################################
-		# UDF Input Attributes. The following are standard Hazus names/capitalizations.
-		#########################################################################################################
-		UserDefinedFltyId		= "UserDefinedFltyId"   # Name change example:  UserDefinedFltyId = "UDFID"
-		OccupancyClass			= "OccupancyClass"
-		Cost					= "Cost"
-		ContentCost				= "ContentCost"
-		Area					= "Area"
-		NumStories				= "NumStories"
-		FoundationType			= "FoundationType"
-		FirstFloorHt			= "FirstFloorHt"
-		BldgDamageFnID			= "BldgDamageFnID"  # Yes, a capitalization quirk. We retain the Hazus convention.
-		ContDamageFnId			= "ContDamageFnId"
-		InvDamageFnId			= "InvDamageFnId"
-		# Note there is no Hazus or CDMS equivalent for the following two input variables - see User Guide
-		InvCost					= "InvCost"
-		flC						= "flC"
-
-		# If your UDF Naming Convention differs from the Hazus namings,
-		# you can specify your names here, and override the assignments above
-		# Example: (of course, uncomment this)
-		# UserDefinedFltyId = "UDF_ID"
-
-		# Note that this script has no use for the following Hazus-MH Flood UDF variables:
-		#	Name, Address, City, Statea, Zipcode, Contact, PhoneNumber, YearBuilt, BackupPower,
-		#	ShelterCapacity, Latitude, Longitude, Comment, BldgType, DesignLevel, FloodProtection
-
-		#########################################################################################################
-		#  UDF Output Attributes
-		#########################################################################################################
-		# Good programming practice: have these names as variables rather than hardcoded within commands
-		# Most users need not change these, unless you do not like the names
-		BldgDmgPct				= "BldgDmgPct"
-		BldgLossUSD				= "BldgLossUSD"
-		ContentCostUSD			= "ContentCostUSD"
-		ContDmgPct				= "ContDmgPct"
-		ContentLossUSD			= "ContentLossUSD"
-		InventoryCostUSD		= "InventoryCostUSD"
-		InvDmgPct				= "InvDmgPct"
-		InventoryLossUSD 		= "InventoryLossUSD"
-
-		# Note there are no Hazus equivalents for the following output attributes.
-		# DOGAMI believes these to be value-added, and suggests Hazus provide this information.
-		# See spreadsheet accompanying the script for naming convention
-		flExp 		= "flExp"
-		Depth_in_Struc	= "Depth_in_Struc"
-		Depth_Grid	= "Depth_Grid"    # The renamed raster sample data. "RASTERVALU" is not a useful name
-		SOID		= "SOID"		# Specific Occupancy ID
-		BDDF_ID		= "BDDF_ID"
-		CDDF_ID		= "CDDF_ID"
-		IDDF_ID		= "IDDF_ID"
-		DebrisID	= "DebrisID"
-		Debris_Fin	= "Debris_Fin"  	# Debris for Finish work
-		Debris_Struc= "Debris_Struc"  	# Debris from structural elements
-		Debris_Found= "Debris_Found"   	# Debris from foundation
-		Debris_Tot	= "Debris_Tot"      # Total Debris - sum of the previous
-		GridName	= "GridName"
-		Restor_Days_Min	= "Restor_Days_Min" # Repair/Restoration times
-		Restor_Days_Max	= "Restor_Days_Max"
-
-		#########################################################################################################
-		#  Setups for other namings.
-		#########################################################################################################
-		# Building, Content, Inventory DDF Lookup tables. Use these if user does not supply their own DDF_ID
-		# Note that Inventory has no unique LUTs for Coastal Zones.
-		# Prefix Naming Convention in this program:
-		#   B   Building
-		#   C   Content
-		#   I   Inventory
-		BR	  	= "Building_DDF_Riverine_LUT_Hazus4p0.csv"
-		BCA	 	= "Building_DDF_CoastalA_LUT_Hazus4p0.csv"
-		BCV	 	= "Building_DDF_CoastalV_LUT_Hazus4p0.csv"
-		BFull	= "flBldgStructDmgFn.csv"	# Full DDF library for Building Structural damage
-
-		CR	  	= "Content_DDF_Riverine_LUT_Hazus4p0.csv"
-		CCA	 	= "Content_DDF_CoastalA_LUT_Hazus4p0.csv"
-		CCV	 	= "Content_DDF_CoastalV_LUT_Hazus4p0.csv"
-		CFull	= "flBldgContDmgFn.csv"	# Full DDF library for Building Content damage
-
-		IR	  	= "Inventory_DDF_LUT_Hazus4p0.csv"
-		IFull	= "flBldgInvDmgFn.csv"	# Full DDF library for Building Inventory damage
-		IEconParams	= "flBldgEconParamSalesAndInv.csv"  # Needed to calculate business inventory value and loss
-		DebrisX	= "flDebris_LUT.csv"	# A synthesis of [dbo].[flDebris] and information Hazus Flood Technical Manual (2011), Table 11.1
-		RestFnc	= "flRsFnGBS_LUT.csv"	# A modification of [db].[flRsFnGBS] to make it compatible for lookup table purposes
-
-		# Other Lookup tables exported from SQL database that may be of interest for Direct Economic Loss calculations.
-		# The basic need DOGAMI had was to establish the building restoration times -
-		# and that is fundamental information for all other direct economic loss calculations
-		# DOGAMI did not calculate, for example, rental income loss.
-		# You can expand the functionality, if you wish,
-		# following the methods outlined in the Hazus Flood Technical Manual (2011)
-		#xx = "flBldgEconParamWageCapitalIncome.csv"
-		#xx = "flBldgEconParamRental.csv"
-		#xx = "flBldgEconParamRecaptureFactors.csv"
-		#xx = "flBldgEconParamOwnerOccupied.csv"
-
 		# Process some of the user input.
 		UDFRoot	 = os.path.basename(UDFOrig)
 		ts = ('{:%Y%m%d-%H%M}'.format(datetime.datetime.now()))  # Date Stamp for the file gdb name
@@ -206,648 +367,118 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning):
 		Resultsfgdb = os.path.join(ResultsDir,y)
 		arcpy.AddMessage("Results geodatabase: " + Resultsfgdb)
 
-		# Set up the look-up tables
-		BRP  = os.path.join(LUT_Dir, BR)
-		BCAP = os.path.join(LUT_Dir, BCA)
-		BCVP = os.path.join(LUT_Dir, BCV)
-		BFP  = os.path.join(LUT_Dir, BFull)
-		CRP  = os.path.join(LUT_Dir, CR)
-		CCAP = os.path.join(LUT_Dir, CCA)
-		CCVP = os.path.join(LUT_Dir, CCV)
-		CFP  = os.path.join(LUT_Dir, CFull)
-		IRP  = os.path.join(LUT_Dir, IR)
-		IFP  = os.path.join(LUT_Dir, IFull)
-		IEP  = os.path.join(LUT_Dir, IEconParams)
-		Debris = os.path.join(LUT_Dir,DebrisX)
-		Rest = os.path.join(LUT_Dir,RestFnc)
-
-		# Process the look-up tables into a list of Dictionary elements
-		# Note the standard (default) Lookup Tables were separately developed.
-		# Yes, they are a subset of the full lookup table
-		bddf_lut_riverine 	= [row for row in csv.DictReader(open(BRP))]
-		bddf_lut_coastalA 	= [row for row in csv.DictReader(open(BCAP))]
-		bddf_lut_coastalV 	= [row for row in csv.DictReader(open(BCVP))]
-		bddf_lut_full	 	= [row for row in csv.DictReader(open(BFP))]
-
-		cddf_lut_riverine 	= [row for row in csv.DictReader(open(CRP))]
-		cddf_lut_coastalA 	= [row for row in csv.DictReader(open(CCAP))]
-		cddf_lut_coastalV 	= [row for row in csv.DictReader(open(CCVP))]
-		cddf_lut_full	 	= [row for row in csv.DictReader(open(CFP))]
-
-		iddf_lut_riverine 	= [row for row in csv.DictReader(open(IRP))]
-		iddf_lut_full	 	= [row for row in csv.DictReader(open(IFP))]
-		iecon_lut			= [row for row in csv.DictReader(open(IEP))]
-
-		debris_lut			= [row for row in csv.DictReader(open(Debris))]
-		rest_lut			= [row for row in csv.DictReader(open(Rest))]
-
-		# Build up lists to use for checking legitimate user-supplied DDF_ID values
-		bddf_lut_full_list = []
-		cddf_lut_full_list = []
-		iddf_lut_full_list = []
-		for x in bddf_lut_full:
-			bddf_lut_full_list.append(x['BldgDmgFnID'])    # Yes, the capitalization is due to a quirk in the [dbo].[flBldgStructDmgFn].
-		for x in cddf_lut_full:
-			cddf_lut_full_list.append(x['ContDmgFnId'])  # Yes, the case is inconsistent with Building column name. That's the way the Hazus database is.
-		for x in iddf_lut_full:
-			iddf_lut_full_list.append(x['InvDmgFnId'])
-
-		Content_x_0p5 = ['RES1','RES2','RES3A','RES3B','RES3C','RES3D','RES3E','RES3F','RES4','RES5','RES6','COM10']
-		Content_x_1p0 = ['COM1','COM2','COM3','COM4','COM5','COM8','COM9','IND6','AGR1','REL1','GOV1','EDU1']
-		Content_x_1p5 = ['COM6','COM7','IND1','IND2','IND3','IND4','IND5','GOV2','EDU2']
-
-		# Default inventory DDF only defined for a subset. IF not in this set, set default Inventory Cost Basis = 0
-		Inventory_List = ['COM1','COM2','IND1','IND2','IND3','IND4','IND5','IND6','AGR1']
-
 		# Check for the presence of optional fields (Coastal Flooding, user-supplied DDFs for Building, Content, Inventory)
 		#
 		CoastalZoneSupplied = ubddf = ucddf = uiddf =  cdest = idest = CoastalZoneCode = uccost = uicost = 0
-		xt = arcpy.ListFields(UDFOrig,flC)
-		if len(xt):
+		UDFFields = set(fld.name.lower() for fld in arcpy.ListFields(UDFOrig))	# One catalog query, then set membership tests. Field names are not case sensitive
+		if flC.lower() in UDFFields:
 			arcpy.AddMessage( "Coastal Flooding attribute (flC) supplied. Will use where specified")
 			CoastalZoneSupplied = 1
 
-		xt = arcpy.ListFields(UDFOrig,BldgDamageFnID)
-		if len(xt):
+		if BldgDamageFnID.lower() in UDFFields:
 			arcpy.AddMessage( "User-supplied Building Depth Damage Function (BldgDamageFnID) attribute supplied. Will use where specified")
 			ubddf = 1
 
-		xt = arcpy.ListFields(UDFOrig,ContDamageFnId)
-		if len(xt):
+		if ContDamageFnId.lower() in UDFFields:
 			arcpy.AddMessage("User-supplied Content  Depth Damage Function attribute (ContDamageFnId supplied. Will use where specified")
 			ucddf = 1
 
-		xt = arcpy.ListFields(UDFOrig,InvDamageFnId)
-		if len(xt):
+		if InvDamageFnId.lower() in UDFFields:
 			arcpy.AddMessage("User-supplied Inventory Depth Damage Function attribute (InvDamageFnId supplied. Will use where specified")
 			uiddf = 1
 
-		xt = arcpy.ListFields(UDFOrig,ContentCost)
-		if len(xt):
+		if ContentCost.lower() in UDFFields:
 			arcpy.AddMessage( "User-supplied Content Cost supplied.  Will use user supplied value where specified, else use the default")
 			uccost = 1
 
-		xt = arcpy.ListFields(UDFOrig,InvCost)
-		if len(xt):
+		if InvCost.lower() in UDFFields:
 			arcpy.AddMessage("User-supplied Inventory Cost supplied.  Will use user supplied value where specified, else use the default")
 			uicost = 1
 
+		flags = dict(QC_Warning=QC_Warning, CoastalZoneSupplied=CoastalZoneSupplied, ubddf=ubddf, ucddf=ucddf, uiddf=uiddf,
+			uccost=uccost, uicost=uicost)
+
 		# Process each depth grid specified by user
 		DGrids = DepthGrids.split(';')   # Using the interactive window, it's not a list. Make it so.
-		for dgp in DGrids:
-			arcpy.AddMessage(" ")    # A formatting step to improve readability of output)
-			arcpy.AddMessage( "Querying depth grid " + dgp)
-
-			# Set up the Results file. Extract grid to points, add needed fields, adjust for First Floor Height.
-			# Depth_in_Struc:  The adjusted flood depth
-			# flExp:   A simple 1/0 statement: is the UDF in the specified floodplain or is it not?
-			# SOID = SpecificOccupId.  A conversion of the OccupancyClass, FoundationType, and NumStories fields into a 4 to 5 character string for lookup.
-			# BDDF_ID = the particular Depth Damage Function ID used for that record
-			# BldgDmgPct = Loss Ratio for Building
-			# BldgLossUSD = Estimated Building Loss in US$  (some fraction of the user-specified Cost)
-			#
-			# Need to strip out any periods in the depth grid file name, say, "depth100.tif", as periods are COMPLETELY UNACCEPTABLE in fgdb feature class naming
-			# And if an input shapefile is specified, drop the *.shp extension. So a Texas Two Step to get a clean name
-			y = os.path.split(dgp)[1]
-			x = UDFRoot.split('.')[0] + "_" + y.split('.')[0]
-			ResultsFile = os.path.join(Resultsfgdb,x)
-			arcpy.AddMessage("Writing results to " + ResultsFile)
-			gridroot = y    #  Put into an attribute in the Results file. Redundant, but handy when appending multiple results files together.
-
-			# Some research should go into INTERPOLATE versus NONE in the next function.
-			# A cursory peek suggested Hazus-MH Flood does 'NONE' (it had a better match).
-			# So to better match to the Hazus-MH Flood results, we (for now) choose 'NONE'.
-			ExtractValuesToPoints(UDFOrig, dgp, ResultsFile, "NONE", "VALUE_ONLY")
-			# Change name of the generic RASTERVALU to Depth_Grid
-			arcpy.AlterField_management(ResultsFile,"RASTERVALU",Depth_Grid,Depth_Grid)
-
-			# Add the needed fields. Format of command came from ArcGIS "Copy as snippet", so has excess verbiage which could probably be tossed.
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Depth_in_Struc, 	field_type="FLOAT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=flExp,	 		field_type="SHORT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=SOID,				field_type="TEXT", field_precision="", field_scale="", field_length="5", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=BDDF_ID,			field_type="TEXT", field_precision="", field_scale="", field_length="6", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=BldgDmgPct,		field_type="FLOAT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=BldgLossUSD,		field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=ContentCostUSD,	field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=CDDF_ID,			field_type="TEXT", field_precision="", field_scale="", field_length="6", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=ContDmgPct,		field_type="FLOAT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=ContentLossUSD,	field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=InventoryCostUSD,	field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=IDDF_ID,			field_type="TEXT", field_precision="", field_scale="", field_length="6", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=InvDmgPct,		field_type="FLOAT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=InventoryLossUSD,	field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=DebrisID,			field_type="TEXT", field_precision="", field_scale="", field_length="12", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Debris_Fin,		field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Debris_Struc,		field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Debris_Found,		field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Debris_Tot,		field_type="LONG", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Restor_Days_Min,	field_type="SHORT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=Restor_Days_Max,	field_type="SHORT", field_precision="", field_scale="", field_length="", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-			arcpy.AddField_management(in_table=ResultsFile,field_name=GridName,			field_type="Text", field_precision="", field_scale="", field_length="70", field_alias="", field_is_nullable="NULLABLE", field_is_required="NON_REQUIRED", field_domain="")
-
-			# Process each UDF record, calculating its damage based on depth and building type.
-			arcpy.AddMessage("Processing depth grid "+ dgp +  " record by record")
-			cursor = arcpy.UpdateCursor(ResultsFile)
-			counter = 0
-			for row in cursor:
-				counter += 1
-				if counter % 10000 == 0 and QC_Warning:
-					arcpy.AddMessage( "   processing record " + str(counter))
-
-				###################################################
-				# Depth Adjustments
-	   			###################################################
-				# Adjust Depth-in-Structure, given the First Floor Height. This will produce the occasional negative value. That is OK
-				# NOTE: Some users suggest that Coastal Flooding should be adjusted by an additional 1.0 foot, because in coastal flooding,
-				# FFH should be considered to be at the freeboard.
-				# However, we confirmed with the Hazus coding team that the Hazus-MH Flood model does NO such adjustment
-				# So for now, we do not do ANY FFH adjustment
-				#
-				# Note this simple calculation varies with the Hazus-MH flood model implementation that rounds FFH to the nearest 0.5 foot level
-				# (which will produce minor differences in the loss ratio calculation).
-				# We maintain the script implements the methods more cleanly. There was no compelling technical reason for
-				# the Hazus-MH flood model to round to the nearest 0.5 foot.
-				rastervalue = row.getValue(Depth_Grid)
-				FFHeight = row.getValue(FirstFloorHt)
-				depth = rastervalue - FFHeight if rastervalue is not None else None   # Must mind the empty (null) case where the UDF has no Raster values
-				userDefinedFltyId = row.getValue(UserDefinedFltyId)   # Capture it for reporting purposes when encountering records with odd values.
-
-				# Get some basic information for the record
-				# One could insert some quality checks here and revert to a default if an illegal OccupancyClass, FoundationType, or NumStories
-				# At minimum, clean up the Occupancy Class. This sometimes has trailing spaces, due to Hazus processing quirks.
-				x				= row.getValue(OccupancyClass)
-				OC				= x.strip()
-				x 				= row.getValue(FoundationType)
-				foundationType  = x.strip()
-				numStories 		= row.getValue(NumStories)
-				area 			= row.getValue(Area)    # Used in Inventory Loss Calculation
-				if CoastalZoneSupplied:
-					CoastalZoneCode = row.getValue(flC) # Only acquire if a Coastal Zone is defined for that UDF
-					CoastalZoneCode = "" if CoastalZoneCode is None else CoastalZoneCode.strip()
-
-				# Build up the SpecifOccupId based on OccupancyClass,NumStories,FoundationType:
-				# Prefix, Middle Character, Suffix
-				#
-				# Prefix: Take advantage of the Slice feature in Python. Note the negative sign for right() equivalent
-				# Note that REL1 is the exception in the OccupancyClass list.
-				# QC:  We may want to bark an exception here: check for illegal OccupancyClass? or other combos (e.g. RES2 with more than one story)
-				sopre = OC[:1]+OC[-(len(OC)-3):] if OC != 'REL1' else 'RE1'
-
-				# Suffix: Easy - Basement or no Basement
-				sosuf = 'B' if foundationType == '4' else 'N'
-
-				# Middle Character: Number of Stories
-				if OC[:4] == 'RES3':
-					# RES3 has three categories: 1 3 5
-					somid = '5' if numStories > 4 else '3' if numStories > 2 else '1'
-
-				elif OC[:4] == 'RES1':
-					# If NumStories is not an integer, assume Split Level residence
-					# Also, cap it at 3.
-					numStories = 3 if numStories > 3 else numStories
-					somid = str(numStories) if numStories - int(numStories) == 0 else 'S'
-
-				elif OC[:4] == 'RES2':
-					# Manuf. Housing is by definition limited to one story
-					somid = '1'
-
-				else:
-					# All other cases: Easy!  1-3, 4-7, 8+
-					somid = 'H' if numStories > 6 else 'M' if numStories > 3 else 'L'
-
-				SpecificOccupId = sopre + somid + sosuf
-				row.setValue(SOID,SpecificOccupId)
-
-				# Content and Inventory Cost. Determine each, even if structure not exposed to flooding
-				# Content Loss in US$: depends if user supplied a content cost field, and if it is > 0.
-				# If not, then use a default multiplier, depending on OccupancyClass, per Hazus-MH Flood Technical Manual table
-				CMult =  0.5 if OC in Content_x_0p5 else 1.0 if OC in Content_x_1p0 else 1.5 if OC in Content_x_1p5 else 0
-				if uccost:
-					xt = row.getValue(ContentCost)
-					xt = -1 if xt is None else xt	 # Null value check. If ContentCost is NULL,use the default value
-				else:
-					xt = -1
-				ccost = row.getValue(Cost) * CMult if xt == -1 else xt
-
-				# Inventory Cost
-				OWDI = OC in Inventory_List
-				xt = row.getValue(InvCost) if uicost else -1
-				xt = xt if xt is not None else -1   #  Clean up case where InvCost is supplied but is null
-				if OWDI and xt == -1:
-					# Use default cost formula
-					for lutrow in iecon_lut:
-						if lutrow['Occupancy'] == OC:
-							GrossSales = lutrow['AnnualSalesPerSqFt']
-							BusinessInv = lutrow['BusinessInvPctofSales']
-							# Table imports as string type (?!) so we must convert tabular data to a float type
-							# Yes, raw data is typically in Integer format, be flexible for future data which may be available in dollars.cents
-							# Must divide by 100, as BusinessInv in the input table is a Percent figure
-							# Area is in Square Feet
-							icost = float(GrossSales)*float(BusinessInv)*area/100
-							break
-				# If a user-supplied Inventory Cost is supplied, use it.
-				elif xt > -1 :
-					icost = row.getValue(InvCost)
-				else:
-					icost =0
-
-				row.setValue(ContentCostUSD,ccost)
-				row.setValue(InventoryCostUSD,icost)
-
-				# If no depth measured for that point, set some default values for the output to clearly indicate that there is No Exposure
-				# and quickly move on to the next record
-				if depth is None or depth < -500:	# Depending on Depth Grid format, the Extract_2_Point returns Null or -9999
-					row.setValue(flExp,0)	# Structure is NOT exposed.
-					row.setValue(Depth_in_Struc,None)	# Default value, again emphasizing the point is not exposed. Make SummaryStats more straightforward
-					row.setValue(BDDF_ID,0)
-					row.setValue(BldgDmgPct,0)
-					row.setValue(BldgLossUSD,0)
-					row.setValue(CDDF_ID,0)
-					row.setValue(ContDmgPct,0)
-					row.setValue(ContentLossUSD,0)
-					row.setValue(IDDF_ID,0)
-					row.setValue(InvDmgPct,0)
-					row.setValue(InventoryLossUSD,0)
-					row.setValue(DebrisID,'')
-					row.setValue(Debris_Fin,None) # Partition the Debris into its three components - Table 11.1 Hazus-MH Flood Technical Manual
-					row.setValue(Debris_Struc,None)
-					row.setValue(Debris_Found,None)
-					row.setValue(Debris_Tot,None)
-					row.setValue(Restor_Days_Min,0)
-					row.setValue(Restor_Days_Max,0)
-				else:
-					# The UDF is exposed. Calculate Building, Content, Inventory Losses
-					row.setValue(flExp,1)
-					row.setValue(Depth_in_Struc, depth)  # Record the depth in structure.
-					# (To be considered: optional freeboard adjustment for Coastal Flooding)
-					# Hazus 4.0 model does *no* adjustment. Some have suggested that one should add a freeboard margin; e.g., adjust FFH by -1 foot.
-					# But there is no clear consensus on such a conservative adjustment.
-
-					# If depth is over 24 feet or less than -4 feet, then adjust depth. LUTs do not extend beyond that range!
-					# Note that Hazus-MH flood model caps the grid raster at 24 feet, then does the subtraction. This creates some differences in results.
-					# We believe that you do the FFH subtraction before capping the depth at 24 feet.
-					depth = 24 if depth > 24 else depth
-					depth = -4 if depth < -4 else depth
-
-					# Get some basic information for the record
-					# One could insert some quality checks here andrevert to a default if an illegal OccupancyClass, FoundationType, or NumStories
-					# At minimum, clean up the Occupancy Class. This sometimes has trailing spaces, due to Hazus processing quirks.
-					x				= row.getValue(OccupancyClass)
-					OC				= x.strip()
-					x 				= row.getValue(FoundationType)
-					foundationType  = x.strip()
-					numStories 		= row.getValue(NumStories)
-					area 			= row.getValue(Area)    # Used in Inventory Loss Calculation
-
-					# Construct the strings for the LUT reference: if depth <0, use 'm'. If >0, use 'p'
-					# See the Column headings in the csv lookup tables.
-					# Need to strip out the minus sign using abs() and the decimal point using int(), and convert it to a string using str()
-					suffix_l = str(int(abs(math.floor(depth))))
-					suffix_u = str(int(abs(math.ceil(depth))))
-					prefix_l = 'm' if math.floor(depth) < 0 else 'p'
-					prefix_u = 'm' if math.ceil(depth) < 0 else 'p'  # Need to fuss over the boundary case  -1 < depth < 0
-					l_index = prefix_l + suffix_l
-					u_index = prefix_u + suffix_u
-
-					###########################################################
-					# BUILDING LOSS CALCULATION
-					###########################################################
-					# Did user specify a Building DDF? If so, use that to reference the Full LUT, else use the Default LUT.
-					# Due to Hazus-MH Flood definitions, this is Text type.
-					BID = row.getValue(BldgDamageFnID) if ubddf else None
-
-					# If BID is specified by the user, and defined, then assume they know what is best, and use the full lookup table.
-					# Tests are ok if you go left-to-right. Go from most-basic-test-to-more-advanced in the same line.  Can't flip the order here!
-					if BID is not None and BID != '' and BID in bddf_lut_full_list:
-						# Search the  full lookup table to find the DDF_ID that matches the BID
-						# 'gotcha' checks for no hits - set a check bit - that should not happen, given the membership test with bddf_lut_full_list.
-						# For more efficiency, break out of the loop if it is found
-						gotcha = 0
-						for lutrow in bddf_lut_full:
-							if lutrow['BldgDmgFnID'] == BID:	# This is a string match. For completeness and trailing spaces, may want to make it an integer?
-								gotcha += 1
-								ddf1 = lutrow
-								# Notify user if the OccupancyClass associated with the user-specified DDFID is inconsistent with the user-supplied OccupancyClass
-								# This is not harmful; DOGAMI script has chosen to just process it (Hazus silently reverts back to the default!)
-								# Simple notification
-								OccClsCheck = ddf1['Occupancy']
-								if OccClsCheck != OC and QC_Warning:
-									arcpy.AddWarning("FYI: User-supplied Building DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
-								break
-						d_lower = float(ddf1[l_index])
-						d_upper = float(ddf1[u_index])
-						ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
-
-					else:
-						# We may have gotten here because of a bad BDDF code. If so, revert to the default and notify user
-						# Note we are in the Default DDF section, and will calculate loss in that manner.
-						if QC_Warning and BID is not None and BID != '' and int(BID)>0:
-							arcpy.AddWarning("User specified a non-official Building DDFID: " + BID + "    UID: " + userDefinedFltyId )
-							arcpy.AddWarning("   Reverting to default Building DDF for Occupancy Class " + OC)
-
-						# Go through the lookup table, one row at a time to find the Structure of interest
-						# 'gotcha' checks for no hits - set a check bit
-						# Also, for more efficiency, break out of the loop if it is found
-						gotcha = 0
-
-						# Change DDF table only if Coastal Zone is defined (CoastalZoneSuppled) AND a legitimate Coastal Zone Code (AE, V, VE)
-						# Otherwise use default ddf.
-						# As of Hazus 4.0, Coastal lookup tables are only applicable for RES-type structures.
-						blut = bddf_lut_riverine
-						if CoastalZoneSupplied and OC[:3] =='RES':
-							if CoastalZoneCode == 'CAE' :
-								blut = bddf_lut_coastalA
-							if CoastalZoneCode == 'VE' or CoastalZoneCode == 'V':
-								blut = bddf_lut_coastalV
-
-						# Now do the lookup in the Default DDF
-						for lutrow in blut:
-							if lutrow['SpecificOccupId'] == SpecificOccupId:
-								gotcha += 1
-								ddf1 = lutrow
-								ddf_id = lutrow['DDF_ID']   # For the Record. Will go in the Results file.
-								break # Quit once you found it.
-						if gotcha == 0:
-							# This should not occur
-							arcpy.AddError( "something wrong, no match for Specific Occupancy ID :" + SpecificOccupId + "   UDF: " + UserDefinedFltyId)
-							arcpy.AddMessage(arcpy.GetMessages(0))
-							sys.exit(2)
-
-					# Dictionary lookup: get damage percentage for the particular row at the particular depths
-					# The Dictionary element comes from either the Full or the Default table; common code after this point.
-					d_lower = float(ddf1[l_index])
-					d_upper = float(ddf1[u_index])
-					# Get fractional amount of depth, for interpolation
-					frac = depth - math.floor(depth)
-					damage = (d_lower + frac*(d_upper - d_lower))/100
-
-					if gotcha == 0:
-						# This should not occur, given the memebership test with bddf_lut_full_list. Just in case:
-						arcpy.AddError("Problem: nothing matches the SpecificOccupId of " + SpecificOccupId + "     Check entry UDFID " + userDefinedFltyId + " with " + OC )
-						SpecificOccupId = "XXXX"
-						BDDF_ID = LR = bldg_loss = -9999
-
-					# Calculate building loss, set other attributes
-					row.setValue(SOID,SpecificOccupId)
-					row.setValue(BDDF_ID,ddf_id)
-					row.setValue(BldgDmgPct,damage*100)  # Hazus convention: percentage
-					bldg_loss = damage * row.getValue(Cost)
-					row.setValue(BldgLossUSD,bldg_loss)
-
-					###########################################################
-					# CONTENT LOSS CALCULATION
-					###########################################################
-					# Did user specify a Content DDF? If so, use that to reference the Full LUT, else use the Default LUT.
-					# Due to Hazus-MH Flood conventions, the CDDF_ID is of type Text
-					BID = row.getValue(ContDamageFnId)if ucddf else None
-
-					# If BID is specified by the user, then assume they know what is best, and use the full lookup table.
-					# Tests are ok if you go left-to-right. Go from most-basic-test-to-more-advanced in the same line.  Can't flip the order here!
-					if BID is not None and BID != '' and BID in cddf_lut_full_list:
-						# Search the  full lookup table to find the DDF_ID that matches the BID
-						# 'gotcha' checks for no hits - set a check bit - that should not happen, given the membership test with bddf_lut_full_list.
-						# For more efficiency, break out of the loop if it is found
-						gotcha = 0
-						for lutrow in cddf_lut_full:
-							if lutrow['ContDmgFnId'] == BID:	# This is a string match. For completeness and trailing spaces, may want to make it an integer?
-								gotcha += 1
-								ddf1 = lutrow
-								# Notify user if the OccupancyClass associated with the user-specified DDFID is inconsistent with the user-supplied OccupancyClass
-								# This is not harmful; DOGAMI script has chosen to just process it (Hazus silently reverts back to the default!)
-								# Simple notification
-								OccClsCheck = ddf1['Occupancy']
-								if OccClsCheck != OC and QC_Warning:
-									arcpy.AddWarning("FYI: User-supplied Content  DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
-								break
-						d_lower = float(ddf1[l_index])
-						d_upper = float(ddf1[u_index])
-						ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
-
-					else:
-						# We may have gotten here because of a bad CDDF code. If so, revert to the default and notify user
-						# Note we are in the Default DDF section, and will calculate loss in that manner.
-						if QC_Warning and BID is not None and BID != '' and int(BID)>0:
-							arcpy.AddWarning( "FYI: User specified a non-official Content DDFID: " + BID + "    UID: " + userDefinedFltyId + "   Reverting to default Content DDF for Occupancy Class " + OC)
-
-						# Go through the lookup table, one row at a time to find the Structure of interest
-						# 'gotcha' checks for no hits - set a check bit
-						# Also, for more efficiency, break out of the loop if it is found
-						gotcha = 0
-
-						# Change DDF table if Coastal; otherwise use default ddf.
-						# As of Hazus 4.0, Coastal lookuptables only applicable for RES-type structures.
-						# Need to filter out "REL" from "RES" - look at second letter
-						clut = cddf_lut_riverine
-						if CoastalZoneSupplied and OC[:3] =='RES':
-							if CoastalZoneCode == 'CAE' :
-								clut = cddf_lut_coastalA
-							if CoastalZoneCode == 'VE' or CoastalZoneCode == 'V':
-								 clut = cddf_lut_coastalV
-
-						for lutrow in clut:
-							if lutrow['SpecificOccupId'] == SpecificOccupId:
-								gotcha += 1
-								ddf1 = lutrow
-								ddf_id = lutrow['DDF_ID']   # For the Record. Will go in the Results file.
-								break # Quit once you found it.
-						if gotcha == 0:
-							# This should not occur
-							arcpy.AddError("something wrong for Content lookup, no match for Specific Occupancy ID :" + SpecificOccupId + "   Counter:" + str(counter))
-
-
-					# Dictionary lookup: get damage percentage for the particular row at the particular depths
-					# The Dictionary element comes from either the Full or the Default table; common code after this point.
-					d_lower = float(ddf1[l_index])
-					d_upper = float(ddf1[u_index])
-					# Get fractional amount of depth, for interpolation
-					frac = depth - math.floor(depth)
-					damage = (d_lower + frac*(d_upper - d_lower))/100
-
-					if gotcha == 0:
-						# Should not occur, given the check for membership in the list. But here just in case
-						arcpy.AddWarning("Problem with Content Loss: nothing matches the SpecificOccupId of " + SpecificOccupId + "Check entry " + str(counter) + " with " + OC + " " + str(numStories))
-						SpecificOccupId = "XXXX"
-						CDDF_ID = LR = bldg_loss = -9999
-
-					row.setValue(CDDF_ID,ddf_id)
-					row.setValue(ContDmgPct,damage*100)   # Hazus convention: percenage
-					content_loss = damage*ccost
-					row.setValue(ContentLossUSD,content_loss)
-
-					###########################################################
-					# INVENTORY LOSS CALCULATION
-					###########################################################
-					# Did user specify an Inventory DDF? If so, use that to reference the Full LUT, else use the Default LUT.
-					# Due to Hazus-MH Flood conventions, the IDDF_ID is of type Text
-					BID = row.getValue(InvDamageFnId) if uiddf else None
-					# If BID is specified by the user, then assume they know what is best, and use the full lookup table.
-					# Tests are ok if you go left-to-right. Go from most-basic-test-to-more-advanced in the same line.  Can't flip the order here!
-					if BID is not None and BID != '' and BID in iddf_lut_full_list:
-						# Search the  full lookup table to find the DDF_ID that matches the BID
-						# 'gotcha' checks for no hits - set a check bit - that should not happen, given the membership test with bddf_lut_full_list.
-						# For more efficiency, break out of the loop if it is found
-						gotcha = 0
-						for lutrow in iddf_lut_full:
-							if lutrow['InvDmgFnId'] == BID:	# This is a string match. For completeness and trailing spaces, may want to make it an integer?
-								gotcha += 1
-								ddf1 = lutrow
-								# Notify user if the OccupancyClass associated with the user-specified DDFID is inconsistent with the user-supplied OccupancyClass
-								# This is not harmful; DOGAMI script has chosen to just process it (Hazus silently reverts back to the default!)
-								# Simple notification
-								OccClsCheck = ddf1['Occupancy']
-								if OccClsCheck != OC and QC_Warning:
-									arcpy.AddWarning("FYI: User-supplied Inventory DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
-								break
-						d_lower = float(ddf1[l_index])
-						d_upper = float(ddf1[u_index])
-						frac = depth - math.floor(depth)
-						damage = (d_lower + frac*(d_upper - d_lower))/100
-						ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
-
-					else:
-						# We may have gotten here because of a bad IDDF code. If so, revert to the default and notify user
-						# Note we are in the Default DDF section, and will calculate loss in that manner.
-						if QC_Warning and BID is not None and BID != '' and int(BID)>0:
-							arcpy.AddWarning( "User specified a non-official Inventory DDFID: " + BID + "    UID: " + userDefinedFltyId + "   Reverting to default Inventory DDF for Occupancy Class " + OC)
-
-						# Go through the lookup table, one row at a time to find the Structure of interest
-						# 'gotcha' checks for no hits - set a check bit
-						# Also, for more efficiency, break out of the loop if it is found
-						gotcha = 0
-
-						# Inventory: There is no Coastal Flooding default table to use
-						ilut = iddf_lut_riverine
-
-						# Default Inventory DDF defined only for a subset of OccupancyClass types
-						if OC in Inventory_List:
-							for lutrow in ilut:
-								if lutrow['SpecificOccupId'] == SpecificOccupId:
-									gotcha += 1
-									ddf1 = lutrow
-									ddf_id = lutrow['DDF_ID']   # For the Record. Will go in the Results file.
-									break # Quit once you found it.
-							if gotcha == 0:
-								# This should not occur
-								arcpy.AddError("something wrong for Inventory lookup, no match for Specific Occupancy ID :" + SpecificOccupId + "   Counter:" + str(counter))
-								arcpy.AddMessage(arcpy.GetMessages(0))
-								sys.exit(2)
-
-							# Dictionary lookup: get damage percentage for the particular row at the particular depths
-							# The Dictionary element comes from either the Full or the Default table; common code after this point.
-							d_lower = float(ddf1[l_index])
-							d_upper = float(ddf1[u_index])
-							# Get fractional amount of depth, for interpolation
-							frac = depth - math.floor(depth)
-							damage = (d_lower + frac*(d_upper - d_lower))/100
-
-							if gotcha == 0:
-								# Should not occur, given the check for membership in the list. But here just in case
-								arcpy.AddWarning("Problem with Inventory Loss: nothing matches the SpecificOccupId of " + SpecificOccupId + "Check entry " + str(counter) + " with " + OC + " " + str(numStories))
-								SpecificOccupId = "XXXX"
-								IDDF_ID = LR = bldg_loss = -9999
-
-
-						else:
-							# No default DDF ID exists for the given OccupancyClass. Fill them in with zeros
-							damage = 0
-							ddf_id = 0
-
-					row.setValue(IDDF_ID,ddf_id)
-					row.setValue(InvDmgPct,damage*100)  # Hazus convention - percentage
-
-					# Inventory Loss in US$: depends if user supplied an inventory cost field, and if it is > 0.
-					# If not supplied, or 0, then use the default value based on OccupancyClass and Square Footage
-					# per Hazus-MH Flood Technical Manual table
-					# But note that the 'default value' is defined only for a subset of OccupancyClasses
-					# Logic spelled out in accompanying spreadsheet - to simplify it, create three variables
-					# OWDI = OccupancyClass with Default Inventory
-					# USID = User-supplied Inventory DDF is supplied and legitimate
-					# USIC = User-supplied Inventory Cost is supplied and non-zero and non-null
-
-
-					inventory_loss = damage * icost
-					row.setValue(InventoryLossUSD,inventory_loss)
-
-					###########################################################
-					# DEBRIS CALCULATIONS
-					###########################################################
-					# Calculate only for exposed buildings
-					if depth is not None:
-						# Build up a DebrisID key for accessing Debris LUT table
-						# Basement/No Basement only defined for RES1.
-						# Slab/Footing: Simple mapping of FoundationType (includes Basement by definition)
-						# dsuf = depth suffix
-						bsm = 'NB'   # No Basement is the default. Only override for RES1
-						fnd = 'SG' if (foundationType == '4' or foundationType == '7') else 'FT'  # SG: Slab on Grade.  FT = ???? DEFINE THIS - FROM BBOHN.
-						# Flood depth key varies, depending if it's a RES1/Basement.
-						if OC == 'RES1' and foundationType == '4':
-							bsm = 'B'
-							dsuf = '-8' if depth <-4 else '-4' if depth < 0 \
-								else '0' if depth <4 else '4' if depth < 6 \
-								else '6' if depth <8 else '8'
-						else:  # Credit to BBohn who identified 0/1/4/8/12 as common breakpoints shared by all non-RES1-Basement
-							dsuf = '0' if depth <1 else '1' if depth < 4 \
-						  	else '4' if depth <8 else '8' if depth < 12 else '12'
-						debriskey = OC + bsm + fnd + dsuf
-
-						for lutrow in debris_lut:
-							if lutrow['DebrisID'] == debriskey:	# This is a string match. For completeness and trailing spaces, may want to make it an integer?
-								gotcha += 1
-								ddf1 = lutrow
-						dfin_rate	=  float(ddf1['Finishes'])
-						dstruc_rate =  float(ddf1['Structure'])
-						dfound_rate =  float(ddf1['Foundation'])
-						# All LUT numbers are in tons per 1000 square feet, so adjust for your particular structure
-						dfin		= area * dfin_rate / 1000
-						dstruc		= area * dstruc_rate / 1000
-						dfound		= area * dfound_rate / 1000
-						dtot		= dfin + dstruc + dfound
-					else:
-						dfin = dstruc = dfound = dtot = debriskey = None
-
-					row.setValue(DebrisID,debriskey)
-					row.setValue(Debris_Fin,dfin)
-					row.setValue(Debris_Struc,dstruc)
-					row.setValue(Debris_Found,dfound)
-					row.setValue(Debris_Tot,dtot)
-
-					###########################################################
-					# Restoration Time Calculation - the basis for all Direct Economic Loss numbers
-					# Based on the Min and Max days listed in   [dbo].[flRsFnGBS]
-					# Note how the table differs slightly from the TM, esp with Res with basements
-					# Note that the TM suggests some of these are not subject to a 10% threshold
-					# The method suggests using the Maximum; for completeness, the script produces both.
-					###########################################################
-					# Calculate only for exposed buildings.
-					if depth is not None:
-						# Build up a key for accessing the Restoration Time LUT table
-						dsuf = '0' if depth <0 else '1' if depth < 1 \
-						  	else '4' if depth <4 else '8' if depth < 8 else '12' if depth < 12 else '24'
-						RsFnkey = OC + dsuf
-						for lutrow in rest_lut:
-							if lutrow['RestFnID'] == RsFnkey:	# This is a string match. For completeness and trailing spaces, may want to make it an integer?
-								ddf1 = lutrow
-								break
-						restdays_min =  int(ddf1['Min_Restor_Days']) # This is the maximum days out (flRsFnGBS has a min and a max)
-						restdays_max =  int(ddf1['Max_Restor_Days']) # This is the maximum days out (flRsFnGBS has a min and a max)
-					else:
-						restdays_min = restdays_max = 0   # Or should it be None type?
-					row.setValue(Restor_Days_Min,restdays_min)
-					row.setValue(Restor_Days_Max,restdays_max)
-
-				# When running multiple grids, sensitivity tests, etc, adding the gridname makes it easier to sort upon an appended dataset
-				row.setValue(GridName,gridroot)
-				cursor.updateRow(row)
-
-			arcpy.AddMessage("Total records processed: " + str(counter))
-
-		del row
-		del cursor
+
+		# With several grids, sample them all at the UDF points in a single Sample call (one pass over the points,
+		# one output table with a column per grid) rather than a separate ExtractValuesToPoints per grid.
+		# The values are joined back on UserDefinedFltyId, so Sample is only used when it is unique and never Null;
+		# otherwise, and in ArcMap, whose Sample has no unique ID parameter, each grid is extracted on its own.
+		# Intermediate tables (the Sample table, and the per-grid geodatabases of the worker processes) go into a
+		# scratch folder next to the Results geodatabase, which is deleted at the end.
+		samples = [None] * len(DGrids)
+		sample_tbl = None
+		if len(DGrids) > 1:
+			ScratchDir = tempfile.mkdtemp(prefix=x + "_scratch_", dir=ResultsDir)
+			uids = [row[0] for row in arcpy.da.SearchCursor(UDFOrig, [UserDefinedFltyId])]
+			if None in uids or len(set(uids)) != len(uids):
+				arcpy.AddMessage("UserDefinedFltyId is not unique for every record; each depth grid is extracted on its own")
+			else:
+				arcpy.CreateFileGDB_management(ScratchDir, "Sample")
+				sample_tbl = os.path.join(ScratchDir, "Sample.gdb", "DepthGridSample")
+				try:
+					Sample(in_rasters=DGrids, in_location_data=UDFOrig, out_table=sample_tbl, resampling_type="NEAREST", unique_id_field=UserDefinedFltyId)
+				except TypeError:
+					sample_tbl = None
+			del uids
+		if sample_tbl is not None:
+			sfields = _sample_fields(sample_tbl, DGrids)
+			if sfields is None:
+				arcpy.AddMessage("Sampled depth grid fields not recognized; each depth grid is extracted on its own")
+				arcpy.Delete_management(sample_tbl)
+				sample_tbl = None
+			else:
+				samples = [(sample_tbl, sfields[0], col) for col in sfields[1]]
+
+		# The grids are independent of each other, so with more than one, spread them over worker processes
+		# (see _grid_worker). Each writes its Results into a geodatabase of its own, and this process copies them
+		# into the Results geodatabase, one at a time, and passes on their ArcGIS messages, as each grid is finished.
+		# With a single grid, its records are spread over worker processes instead (see _process_one_grid).
+		# ArcMap's Python 2.7 has no concurrent.futures; there everything is processed in this process.
+		done = 0	# Depth grids completed, reported if a look-up failure stops the run
+		ncpu = (os.cpu_count() or 1) if futures is not None else 1
+		nworkers = min(len(DGrids), ncpu)
+		if ncpu > 1:
+			# Run as a script tool inside ArcGIS Pro, sys.executable is the application itself; workers must be started with python.
+			pyexe = os.path.join(sys.exec_prefix, 'python.exe')
+			if os.path.basename(sys.executable).lower() != 'python.exe' and os.path.exists(pyexe):
+				multiprocessing.set_executable(pyexe)
+		if nworkers > 1:
+			arcpy.AddMessage(" ")
+			arcpy.AddMessage("Processing " + str(len(DGrids)) + " depth grids, " + str(nworkers) + " at a time")
+			n = len(DGrids)
+			flags['row_workers'] = 1	# The processors are taken by the grids
+			with futures.ProcessPoolExecutor(max_workers=nworkers) as ex:
+				for dgp, (ScratchFile, counter, out) in zip(DGrids, ex.map(_grid_worker, range(n), DGrids, [UDFOrig]*n, [ScratchDir]*n,
+						[LUT_Dir]*n, [flags]*n, samples)):
+					for kind, msg in out:
+						_add_message(None, kind, msg)
+					ResultsFile = os.path.join(Resultsfgdb, os.path.basename(ScratchFile))
+					arcpy.Copy_management(ScratchFile, ResultsFile)
+					arcpy.AddMessage("Depth grid " + dgp + " done. Results in " + ResultsFile + ", total records processed: " + str(counter))
+					done += 1
+		else:
+			flags['row_workers'] = ncpu
+			luts = _load_luts(LUT_Dir)
+			for dgp, sample in zip(DGrids, samples):
+				_process_one_grid(dgp, UDFOrig, Resultsfgdb, LUT_Dir, flags, luts, sample)
+				done += 1
+
 		arcpy.CheckInExtension("Spatial")  # Be a mensch
 
 		# Measuring the script performance
 		arcpy.AddMessage(" ")
 		arcpy.AddMessage("Program Duration:  %s seconds" %  int((time.time() - start_time)))
+	except HazusLookupError as e:
+		# A look-up table gap, not a Python fault: report it, and what was finished, without the traceback
+		arcpy.CheckInExtension("Spatial")  # Be a mensch
+		for kind, msg in getattr(e, 'messages', ()):	# From a worker process, see _grid_worker
+			_add_message(None, kind, msg)
+		_flush_messages(e.warnings, e.errors)	# What was found for the records before the failing one
+		arcpy.AddError(str(e))
+		arcpy.AddMessage(str(done) + " of " + str(len(DGrids)) + " depth grids completed; results in " + Resultsfgdb)
+		arcpy.AddMessage(arcpy.GetMessages(0))
 	except:
 		tb = sys.exc_info()[2]
 		tbinfo = traceback.format_tb(tb)[0]
@@ -857,6 +488,9 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning):
 		arcpy.AddError(msgs)
 		arcpy.AddError(pymsg)
 		arcpy.AddMessage(arcpy.GetMessages(1))
+	finally:
+		if ScratchDir is not None:
+			shutil.rmtree(ScratchDir, ignore_errors=True)	# Intermediate only; every Results file has its own Depth_Grid
 
 # This test allows the script to be used from the operating
 # system command prompt (stand-alone), in a Python IDE,
@@ -0,0 +1,739 @@
+# DOGAMI Hazus Flood Script: the loss calculation, without ArcGIS
+#
+# The look-up tables, the field names and the whole-table damage, debris and restoration calculation of
+# "DOGAMI Hazus Flood Script v3p2.py". Nothing here imports arcpy, so worker processes import this module
+# (rather than the script, with its license checkout) to calculate a chunk of records, and it can be run
+# and checked outside ArcGIS. The script reads the UDF and writes the Results with arcpy; see _process_one_grid.
+# ---------------------------------------------------------------------------
+
+# Variations between systems; some import these by default, others don't. Be explicit.
+import os,csv,math,pickle,re
+import numpy as np	# Ships with ArcGIS; used for the bulk (whole-table) calculations
+try:
+	import pandas as pd	# Ships with ArcGIS Pro. Only used for its fast (C) csv parser when reading the LUTs
+except ImportError:
+	pd = None
+
+# Numba is optional - it is not part of the standard ArcGIS Python install. If present, the numeric kernels below are
+# compiled to machine code on first use (and cached next to this module). If not, the very same code runs as plain NumPy.
+try:
+	from numba import njit
+except ImportError:
+	def njit(*args, **kwargs):
+		return lambda f: f
+
+#########################################################################################################
+# UDF Input Attributes. The following are standard Hazus names/capitalizations.
+#########################################################################################################
+UserDefinedFltyId		= "UserDefinedFltyId"   # Name change example:  UserDefinedFltyId = "UDFID"
+OccupancyClass			= "OccupancyClass"
+Cost					= "Cost"
+ContentCost				= "ContentCost"
+Area					= "Area"
+NumStories				= "NumStories"
+FoundationType			= "FoundationType"
+FirstFloorHt			= "FirstFloorHt"
+BldgDamageFnID			= "BldgDamageFnID"  # Yes, a capitalization quirk. We retain the Hazus convention.
+ContDamageFnId			= "ContDamageFnId"
+InvDamageFnId			= "InvDamageFnId"
+# Note there is no Hazus or CDMS equivalent for the following two input variables - see User Guide
+InvCost					= "InvCost"
+flC						= "flC"
+
+# If your UDF Naming Convention differs from the Hazus namings,
+# you can specify your names here, and override the assignments above
+# Example: (of course, uncomment this)
+# UserDefinedFltyId = "UDF_ID"
+
+# Note that this script has no use for the following Hazus-MH Flood UDF variables:
+#	Name, Address, City, Statea, Zipcode, Contact, PhoneNumber, YearBuilt, BackupPower,
+#	ShelterCapacity, Latitude, Longitude, Comment, BldgType, DesignLevel, FloodProtection
+
+#########################################################################################################
+#  UDF Output Attributes
+#########################################################################################################
+# Good programming practice: have these names as variables rather than hardcoded within commands
+# Most users need not change these, unless you do not like the names
+BldgDmgPct				= "BldgDmgPct"
+BldgLossUSD				= "BldgLossUSD"
+ContentCostUSD			= "ContentCostUSD"
+ContDmgPct				= "ContDmgPct"
+ContentLossUSD			= "ContentLossUSD"
+InventoryCostUSD		= "InventoryCostUSD"
+InvDmgPct				= "InvDmgPct"
+InventoryLossUSD 		= "InventoryLossUSD"
+
+# Note there are no Hazus equivalents for the following output attributes.
+# DOGAMI believes these to be value-added, and suggests Hazus provide this information.
+# See spreadsheet accompanying the script for naming convention
+flExp 		= "flExp"
+Depth_in_Struc	= "Depth_in_Struc"
+Depth_Grid	= "Depth_Grid"    # The renamed raster sample data. "RASTERVALU" is not a useful name
+SOID		= "SOID"		# Specific Occupancy ID
+BDDF_ID		= "BDDF_ID"
+CDDF_ID		= "CDDF_ID"
+IDDF_ID		= "IDDF_ID"
+DebrisID	= "DebrisID"
+Debris_Fin	= "Debris_Fin"  	# Debris for Finish work
+Debris_Struc= "Debris_Struc"  	# Debris from structural elements
+Debris_Found= "Debris_Found"   	# Debris from foundation
+Debris_Tot	= "Debris_Tot"      # Total Debris - sum of the previous
+GridName	= "GridName"
+Restor_Days_Min	= "Restor_Days_Min" # Repair/Restoration times
+Restor_Days_Max	= "Restor_Days_Max"
+
+#########################################################################################################
+#  Setups for other namings.
+#########################################################################################################
+# Building, Content, Inventory DDF Lookup tables. Use these if user does not supply their own DDF_ID
+# Note that Inventory has no unique LUTs for Coastal Zones.
+# Prefix Naming Convention in this program:
+#   B   Building
+#   C   Content
+#   I   Inventory
+BR	  	= "Building_DDF_Riverine_LUT_Hazus4p0.csv"
+BCA	 	= "Building_DDF_CoastalA_LUT_Hazus4p0.csv"
+BCV	 	= "Building_DDF_CoastalV_LUT_Hazus4p0.csv"
+BFull	= "flBldgStructDmgFn.csv"	# Full DDF library for Building Structural damage
+
+CR	  	= "Content_DDF_Riverine_LUT_Hazus4p0.csv"
+CCA	 	= "Content_DDF_CoastalA_LUT_Hazus4p0.csv"
+CCV	 	= "Content_DDF_CoastalV_LUT_Hazus4p0.csv"
+CFull	= "flBldgContDmgFn.csv"	# Full DDF library for Building Content damage
+
+IR	  	= "Inventory_DDF_LUT_Hazus4p0.csv"
+IFull	= "flBldgInvDmgFn.csv"	# Full DDF library for Building Inventory damage
+IEconParams	= "flBldgEconParamSalesAndInv.csv"  # Needed to calculate business inventory value and loss
+DebrisX	= "flDebris_LUT.csv"	# A synthesis of [dbo].[flDebris] and information Hazus Flood Technical Manual (2011), Table 11.1
+RestFnc	= "flRsFnGBS_LUT.csv"	# A modification of [db].[flRsFnGBS] to make it compatible for lookup table purposes
+
+# Depth column headings of the DDF tables, -4 to 24 feet. The column for a whole-foot depth d is at position d + 4
+DDF_Depths = ['m4','m3','m2','m1'] + ['p' + str(d) for d in range(25)]
+
+# Other Lookup tables exported from SQL database that may be of interest for Direct Economic Loss calculations.
+# The basic need DOGAMI had was to establish the building restoration times -
+# and that is fundamental information for all other direct economic loss calculations
+# DOGAMI did not calculate, for example, rental income loss.
+# You can expand the functionality, if you wish,
+# following the methods outlined in the Hazus Flood Technical Manual (2011)
+#xx = "flBldgEconParamWageCapitalIncome.csv"
+#xx = "flBldgEconParamRental.csv"
+#xx = "flBldgEconParamRecaptureFactors.csv"
+#xx = "flBldgEconParamOwnerOccupied.csv"
+
+#########################################################################################################
+# OccupancyClass-dependent constants
+#########################################################################################################
+# Sets rather than lists throughout, so that every 'in' test is a hash lookup rather than a scan
+Content_x_0p5 = frozenset(('RES1','RES2','RES3A','RES3B','RES3C','RES3D','RES3E','RES3F','RES4','RES5','RES6','COM10'))
+Content_x_1p0 = frozenset(('COM1','COM2','COM3','COM4','COM5','COM8','COM9','IND6','AGR1','REL1','GOV1','EDU1'))
+Content_x_1p5 = frozenset(('COM6','COM7','IND1','IND2','IND3','IND4','IND5','GOV2','EDU2'))
+
+# Default inventory DDF only defined for a subset. IF not in this set, set default Inventory Cost Basis = 0
+Inventory_List = frozenset(('COM1','COM2','IND1','IND2','IND3','IND4','IND5','IND6','AGR1'))
+
+# The above only depend on the OccupancyClass, so resolve them into lookup tables once rather than scanning lists per record.
+CMULT_BY_OC = {}
+for cmult, occlist in ((0.5, Content_x_0p5), (1.0, Content_x_1p0), (1.5, Content_x_1p5)):
+	CMULT_BY_OC.update((oc, cmult) for oc in occlist)
+# SpecificOccupId prefix for every legal OccupancyClass. Note that REL1 is the exception to the slicing rule.
+SOPRE_BY_OC = dict((oc, oc[:1]+oc[-(len(oc)-3):]) for oc in CMULT_BY_OC)
+SOPRE_BY_OC['REL1'] = 'RE1'
+# SpecificOccupId suffix: Basement or no Basement
+SOSUF_BY_FOUNDATION = {'4': 'B'}	# Anything else is 'N'
+# SpecificOccupId middle character, indexed by NumStories rounded up (the last entry covers everything above).
+# RES3 has three categories: 1 3 5. Manuf. Housing (RES2) is by definition limited to one story.
+# All other non-RES1 cases: L/M/H for 1-3, 4-6, 7+. RES1 (split levels) is handled in _specific_occup_id.
+SOMID_BY_CLASS = {'RES3': '111335', 'RES2': '1'}
+SOMID_OTHER = 'LLLLMMMH'
+
+# Flood depth breakpoints (feet) of the Debris and Restoration Time LUTs, see flDebris_LUT.csv and flRsFnGBS_LUT.csv
+# Debris: the key is the breakpoint at or below the depth. It varies, depending if it's a RES1/Basement.
+DEBRIS_BINS_RES1B = np.array([-8, -4, 0, 4, 6, 8])
+DEBRIS_BINS = np.array([0, 1, 4, 8, 12])	# Credit to BBohn who identified 0/1/4/8/12 as common breakpoints shared by all non-RES1-Basement
+# Restoration: the key is the first breakpoint above the depth (so 0 means 'below the first floor')
+REST_BINS = np.array([0, 1, 4, 8, 12, 24])
+# Columns of the Debris rate matrix: every Debris breakpoint, RES1/Basement or not (see _load_luts)
+DEBRIS_BREAKS = np.union1d(DEBRIS_BINS_RES1B, DEBRIS_BINS)
+
+#########################################################################################################
+# Results table layout
+#########################################################################################################
+# Output values for a structure that is not exposed to flooding (flExp = 0). The Debris are set to Null,
+# along with Depth_in_Struc, once the results are written.
+NO_EXPOSURE = (
+	(BDDF_ID, '0'), (BldgDmgPct, 0), (BldgLossUSD, 0),
+	(CDDF_ID, '0'), (ContDmgPct, 0), (ContentLossUSD, 0),
+	(IDDF_ID, '0'), (InvDmgPct, 0), (InventoryLossUSD, 0),
+	(DebrisID, ''), (Debris_Fin, 0), (Debris_Struc, 0), (Debris_Found, 0), (Debris_Tot, 0),
+	(Restor_Days_Min, 0), (Restor_Days_Max, 0))
+
+# Output fields written to each results table, as a NumPy dtype; arcpy.da.ExtendTable creates the fields from it
+# (Uxx = TEXT of that length, f4 = FLOAT, i4 = LONG, i2 = SHORT). NumPy truncates a float stored into an integer field,
+# so dollar and debris figures are rounded with np.rint first, as the original per-record setValue did.
+RESULT_DTYPE = [
+	(SOID,				'U5'),
+	(BDDF_ID,			'U6'),
+	(BldgDmgPct,		'f4'),
+	(BldgLossUSD,		'i4'),
+	(CDDF_ID,			'U6'),
+	(ContDmgPct,		'f4'),
+	(ContentLossUSD,	'i4'),
+	(IDDF_ID,			'U6'),
+	(InvDmgPct,			'f4'),
+	(InventoryLossUSD,	'i4'),
+	(DebrisID,			'U12'),
+	(Debris_Fin,		'i4'),
+	(Debris_Struc,		'i4'),
+	(Debris_Found,		'i4'),
+	(Debris_Tot,		'i4'),
+	(Restor_Days_Min,	'i2'),
+	(Restor_Days_Max,	'i2'),
+	(GridName,			'U70')]
+
+#########################################################################################################
+# Numeric kernel for the bulk pass: Depth-in-Structure, exposure, Content and Inventory Cost for every record.
+# Inputs are plain numeric arrays only (no strings, no Nulls) so that Numba can compile it:
+#   cmult       Content Cost default multiplier, pre-resolved from the OccupancyClass (0.0 where none applies)
+#   owdi        bool, OccupancyClass with Default Inventory
+#   content_cost, inv_cost  user-supplied values, -1 where not supplied or Null
+#########################################################################################################
+@njit(cache=True)
+def _compute_rows(depth_grid, ffh, cost, content_cost, inv_cost, area, cmult, owdi, gross_sales, business_inv):
+	depth_in_struc = depth_grid - ffh
+	flexp = depth_in_struc >= -500		# Depending on Depth Grid format, the Extract_2_Point returns Null or -9999
+	ccost = np.where(content_cost == -1, cost * cmult, content_cost)
+	# Default cost formula only for OWDI when no Inventory Cost is given; a user-supplied Inventory Cost is used as is.
+	# Must divide by 100, as BusinessInv in the input table is a Percent figure. Area is in Square Feet
+	icost = np.where(owdi & (inv_cost == -1), gross_sales * business_inv * area / 100, np.where(inv_cost > -1, inv_cost, 0.0))
+	return depth_in_struc, flexp, ccost, icost
+
+#########################################################################################################
+# Numeric kernels for the loss pass, compiled by Numba like _compute_rows above.
+# _depth_columns: clip the depth in structure to the range of the LUTs, -4 to 24 feet, and give the DDF columns
+#   either side of it (see DDF_Depths) and the fractional amount of depth, for interpolation.
+# _interpolate: damage (fraction) for every record, from row index[k] of a matrix of DDF percentages.
+#   The matrix is indexed flat, as Numba supports only one index array per subscript.
+# _bin_at_or_below / _bin_above: the depth breakpoint of the Debris / Restoration LUTs for every record.
+#########################################################################################################
+@njit(cache=True, fastmath=True)
+def _depth_columns(depth_in_struc):
+	depth = np.minimum(np.maximum(depth_in_struc, -4.0), 24.0)
+	# Shifted by the 4 columns below zero, the depth is never negative, so one int cast is the floor
+	col_depth = depth + 4
+	col_lo = col_depth.astype(np.int64)
+	frac = col_depth - col_lo
+	col_hi = col_lo + (frac > 0)	# The ceiling: same column when the depth is a whole foot (e.g. the 24 foot cap)
+	return depth, col_lo, col_hi, frac
+
+@njit(cache=True, fastmath=True)
+def _interpolate(ddf_matrix, index, col_lo, col_hi, frac):
+	flat = ddf_matrix.ravel()
+	row = index * ddf_matrix.shape[1]
+	d_lower = flat[row + col_lo]
+	d_upper = flat[row + col_hi]
+	return (d_lower + frac*(d_upper - d_lower))/100
+
+@njit(cache=True)
+def _bin_at_or_below(bins, depth):
+	return bins[np.maximum(np.searchsorted(bins, depth, side='right') - 1, 0)]
+
+@njit(cache=True)
+def _bin_above(bins, depth):
+	return bins[np.minimum(np.searchsorted(bins, depth, side='right'), len(bins) - 1)]
+
+#########################################################################################################
+# Distinct combinations of the given columns (equal-length arrays): returns the combinations as a list of
+# tuples, and for every record the index of its combination. Lookups that depend only on a few attributes
+# are then done once per combination and spread to all records, rather than once per record.
+#########################################################################################################
+def _unique_rows(*columns):
+	combos, index = np.unique(np.rec.fromarrays(columns), return_inverse=True)
+	return combos.tolist(), index.ravel()
+
+#########################################################################################################
+# Text codes (OccupancyClass, FoundationType, Coastal Zone Code) with the surrounding spaces stripped.
+# There are only a handful of distinct codes, so each is stripped once and spread to all records.
+#########################################################################################################
+def _strip_codes(values):
+	codes, index = np.unique(values.astype('U'), return_inverse=True)
+	return np.char.strip(codes)[index.ravel()]
+
+#########################################################################################################
+# Build up the SpecificOccupId (SOID) based on OccupancyClass, FoundationType, NumStories:
+# Prefix, Middle Character, Suffix. This is the key of the default DDF tables.
+#########################################################################################################
+def _specific_occup_id(OC, foundationType, numStories):
+	# Prefix: precomputed in SOPRE_BY_OC. An unlisted OccupancyClass falls back to the same slicing rule (negative sign for right() equivalent)
+	# QC:  We may want to bark an exception here: check for illegal OccupancyClass? or other combos (e.g. RES2 with more than one story)
+	sopre = SOPRE_BY_OC.get(OC) or OC[:1]+OC[-(len(OC)-3):]
+
+	# Suffix: Easy - Basement or no Basement
+	sosuf = SOSUF_BY_FOUNDATION.get(foundationType, 'N')
+
+	# Middle Character: Number of Stories
+	if OC[:4] == 'RES1':
+		# If NumStories is not an integer, assume Split Level residence
+		# Also, cap it at 3.
+		numStories = 3 if numStories > 3 else numStories
+		somid = str(numStories) if numStories - int(numStories) == 0 else 'S'
+
+	else:
+		# Table lookup, see SOMID_BY_CLASS
+		somid_tbl = SOMID_BY_CLASS.get(OC[:4], SOMID_OTHER)
+		somid = somid_tbl[min(max(int(math.ceil(numStories)), 0), len(somid_tbl) - 1)]
+
+	return sopre + somid + sosuf
+
+#########################################################################################################
+# One DDF library (Building, Content or Inventory) in the form _ddf_damage uses. The full library and the
+# default tables are stacked into a single matrix of damage percentages, one row per DDF and one column per
+# DDF depth (see DDF_Depths), with a last row of zeros for 'no DDF matched'. Alongside are, per row, the DDF ID,
+# whether the row is from the full library, and its Occupancy ('' for the default tables).
+# The rows are indexed by DDF ID as an integer (full library) and by SpecificOccupId (default tables). The Coastal tables
+# are picked by Coastal Zone Code; any other code (or none) uses the riverine table.
+#########################################################################################################
+def _ddf_library(full, id_col, riverine, coastalA=None, coastalV=None):
+	tables = [full, riverine] + ([coastalA, coastalV] if coastalA is not None else [])
+	starts = [0]
+	for lut in tables:
+		starts.append(starts[-1] + len(lut))
+	matrix = np.zeros((starts[-1] + 1, len(DDF_Depths)), dtype=np.float64)
+	for lut, start in zip(tables, starts):
+		for j, c in enumerate(DDF_Depths):
+			matrix[start:start + len(lut), j] = lut[c]
+	# Full library DDF ID as posted in the results. Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
+	ddf_id = np.concatenate([[str(int(i)) for i in full[id_col]]] + [lut['DDF_ID'] for lut in tables[1:]] + [['']])
+	occupancy = np.concatenate([full['Occupancy']] + [np.full(len(lut), '') for lut in tables[1:]] + [['']])
+
+	def by_soid(n):
+		return dict((soid, starts[n] + i) for i, soid in enumerate(tables[n]['SpecificOccupId']))
+	by_zone = {}
+	if coastalA is not None:
+		coastalV_by_soid = by_soid(3)
+		by_zone = {'CAE': by_soid(2), 'VE': coastalV_by_soid, 'V': coastalV_by_soid}
+	return dict(matrix=matrix, ddf_id=ddf_id, occupancy=occupancy, full=np.arange(len(matrix)) < len(full),
+		full_by_id=dict((int(bid), i) for i, bid in enumerate(full[id_col])), by_zone=by_zone, riverine_by_soid=by_soid(1))
+
+#########################################################################################################
+# User-specified DDF IDs (text, per Hazus-MH Flood definitions) as integers: a dict from each of the given
+# IDs to its value, or to None for a blank ID or one that is not an integer (e.g. 'N/A' or '105.0').
+# None is never in the full library, so such records get the default DDF; _loss_ddf reports the unreadable ones.
+#########################################################################################################
+def _parse_ddf_ids(BIDs):
+	ids = {}
+	for bid in BIDs:
+		try:
+			ids[bid] = int(bid)
+		except ValueError:
+			ids[bid] = None
+	return ids
+
+#########################################################################################################
+# Damage from one DDF library (Building, Content or Inventory, see _ddf_library), for every record.
+#   BID     the user-specified DDF ID ('' if none); used when it is in the full library, else the default is used
+#   SOID    SpecificOccupId, the key of the default tables
+#   zone    Coastal Zone Code selecting the default table ('' for the riverine table)
+#   col_lo, col_hi, frac   the DDF depth columns either side of the depth, and the fraction between them
+# The DDFs are resolved to a row of the library's matrix once per distinct (BID, SOID, zone), and each
+# record's two columns are picked out of its row.
+# Returns per record: damage (fraction), DDF ID, found (a DDF matched), full (it came from the full library),
+# and the Occupancy of the full-library DDF ('' for the default).
+#########################################################################################################
+def _ddf_damage(ddf, BID, SOID, zone, col_lo, col_hi, frac):
+	full_by_id, by_zone, riverine_by_soid = ddf['full_by_id'], ddf['by_zone'], ddf['riverine_by_soid']
+	nomatch = len(ddf['matrix']) - 1
+	combos, index = _unique_rows(BID, SOID, zone)
+	rows = np.empty(len(combos), dtype=np.int64)
+	# The default table for each zone is picked once, rather than once per combination
+	default_by_zone = dict((z, by_zone.get(z, riverine_by_soid)) for z in set(z for bid, soid, z in combos))
+	# Likewise each distinct user-specified DDF ID is parsed once. As integers, ' 105' and '0105' match 105.
+	bid_int = _parse_ddf_ids(set(bid for bid, soid, z in combos))
+	for i, (bid, soid, z) in enumerate(combos):
+		if bid_int[bid] in full_by_id:
+			rows[i] = full_by_id[bid_int[bid]]
+		else:
+			rows[i] = default_by_zone[z].get(soid, nomatch)
+	rows = rows[index]
+	damage = _interpolate(ddf['matrix'], rows, col_lo, col_hi, frac)
+	return damage, ddf['ddf_id'][rows], rows != nomatch, ddf['full'][rows], ddf['occupancy'][rows]
+
+#########################################################################################################
+# One loss type (label: 'Building', 'Content' or 'Inventory'), for every record: the damage from its DDF library,
+# see _ddf_damage, plus the QC notifications about user-specified DDF IDs for the exposed records.
+#   exposed, OC, UID   per record: structure exposed to flooding, OccupancyClass, UserDefinedFltyId
+#   warnings   list the notifications are added to, for the script to pass on to ArcGIS
+# Returns per record: damage (fraction), DDF ID, found (a DDF matched), full (it came from the full library).
+#########################################################################################################
+def _loss_ddf(label, ddf, BID, SOID, zone, col_lo, col_hi, frac, exposed, OC, UID, QC_Warning, warnings):
+	damage, ddf_id, found, full, OccClsCheck = _ddf_damage(ddf, BID, SOID, zone, col_lo, col_hi, frac)
+	if QC_Warning:
+		# Notify user if the OccupancyClass associated with the user-specified DDFID is inconsistent with the user-supplied OccupancyClass
+		# This is not harmful; DOGAMI script has chosen to just process it (Hazus silently reverts back to the default!)
+		# Simple notification
+		for i in np.flatnonzero(exposed & full & (OccClsCheck != OC)):
+			warnings.append("FYI: User-supplied " + label + " DDFID " + BID[i] + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC[i] + " versus "+OccClsCheck[i]+ "  " + str(UID[i]))
+		# We may have gotten to the default because of a bad DDF code. If so, notify user
+		bids, index = np.unique(BID, return_inverse=True)
+		bid_int = _parse_ddf_ids(bids.tolist())
+		positive = np.array([(bid_int[b] or 0) > 0 for b in bids.tolist()], dtype=bool)[index.ravel()]
+		for i in np.flatnonzero(exposed & ~full & positive):
+			warnings.append("User specified a non-official " + label + " DDFID: " + BID[i] + "    UID: " + str(UID[i]) + "   Reverting to default " + label + " DDF for Occupancy Class " + OC[i])
+		unreadable = np.array([bid_int[b] is None and b.strip() != '' for b in bids.tolist()], dtype=bool)[index.ravel()]
+		for i in np.flatnonzero(exposed & unreadable):
+			warnings.append("User specified a " + label + " DDFID that is not an integer: " + BID[i] + "    UID: " + str(UID[i]) + "   Reverting to default " + label + " DDF for Occupancy Class " + OC[i])
+	return damage, ddf_id, found, full
+
+#########################################################################################################
+# Raised when a record has no look-up table match where one must exist. Caught in the script's flood_damage, which reports it
+# and how many depth grids were completed, rather than exiting the process from inside the calculation.
+#########################################################################################################
+class HazusLookupError(Exception):
+	# warnings, errors: the messages collected for the records before the failing one, for the caller to pass on
+	def __init__(self, message, warnings=(), errors=()):
+		Exception.__init__(self, message)
+		self.warnings = list(warnings)
+		self.errors = list(errors)
+
+#########################################################################################################
+# Read one csv look-up table into a NumPy structured array: one record per csv row, one typed field per column.
+# The named columns are double precision float (numeric) or int (integer), the rest text. Double, as float() on the
+# csv text gives: the damage percentages are multiplied into dollars, where single precision loses a dollar. Columns are then plain
+# arrays (e.g. lut['BldgDmgFnID']) and a record is indexed by column name just as the csv Dictionary rows were.
+# The csv is parsed with pandas where available (ArcGIS Pro), else with the csv module (ArcMap).
+# The LUTs are static, so the result is pickled to LUT_Dir/.cache/<table>.pkl and reused for as long as the
+# csv file's modification time (and the column conversions) stay the same. If the cache cannot be read or
+# written - e.g. a read-only LUT folder - the csv is simply parsed as usual.
+#########################################################################################################
+LUT_CACHE_DIR = ".cache"
+LUT_CACHE_FORMAT = 4	# Bump whenever _read_lut changes what it returns, so that older caches are not reused
+
+def _read_lut(path, numeric=(), integer=()):
+	cachefile = os.path.join(os.path.dirname(path), LUT_CACHE_DIR, os.path.splitext(os.path.basename(path))[0] + ".pkl")
+	key = (LUT_CACHE_FORMAT, os.path.getmtime(path), tuple(numeric), tuple(integer))
+	try:
+		with open(cachefile, 'rb') as fh:
+			cachekey, lut = pickle.load(fh)
+		if cachekey == key:
+			return lut
+	except Exception:
+		pass	# No cache yet, or one written by another Python version. Re-parse.
+
+	# Parse into one sequence of values per column
+	if pd is not None:
+		header = list(pd.read_csv(path, nrows=0).columns)
+		coltypes = dict((col, np.float64 if col in numeric else np.int32 if col in integer else str) for col in header)
+		df = pd.read_csv(path, engine='c', dtype=coltypes, keep_default_na=False)	# keep_default_na: blanks stay '' rather than NaN
+		columns = [df[col].values for col in header]
+	else:
+		with open(path) as fh:
+			reader = csv.reader(fh)
+			header = next(reader)
+			rows = [r for r in reader]
+		columns = [[r[i] for r in rows] for i in range(len(header))]
+		columns = [[float(v) for v in c] if col in numeric else [int(v) for v in c] if col in integer else c
+			for col, c in zip(header, columns)]
+
+	dtype = []
+	for col, c in zip(header, columns):
+		if col in numeric:
+			dtype.append((col, 'f8'))
+		elif col in integer:
+			dtype.append((col, 'i4'))
+		else:	# Text: wide enough for the longest entry
+			dtype.append((col, 'U' + str(max([1] + [len(v) for v in c]))))
+	lut = np.empty(len(columns[0]) if columns else 0, dtype=dtype)
+	for col, c in zip(header, columns):
+		lut[col] = c
+
+	# Several worker processes may get here at once; write to a private file, then move it into place.
+	try:
+		if not os.path.isdir(os.path.dirname(cachefile)):
+			os.makedirs(os.path.dirname(cachefile))
+		tmpfile = cachefile + "." + str(os.getpid())
+		with open(tmpfile, 'wb') as fh:
+			pickle.dump((key, lut), fh, pickle.HIGHEST_PROTOCOL)
+		if os.path.exists(cachefile):
+			os.remove(cachefile)	# os.rename will not replace an existing file on Windows
+		os.rename(tmpfile, cachefile)
+	except (IOError, OSError):
+		pass
+	return lut
+
+#########################################################################################################
+# Read the look-up tables in LUT_Dir and put them in the form _process_one_grid uses.
+# Kept separate from flood_damage so that each worker process can load them from disk itself,
+# rather than having them pickled across from the main process.
+#########################################################################################################
+def _load_luts(LUT_Dir):
+	# Set up the look-up tables
+	BRP  = os.path.join(LUT_Dir, BR)
+	BCAP = os.path.join(LUT_Dir, BCA)
+	BCVP = os.path.join(LUT_Dir, BCV)
+	BFP  = os.path.join(LUT_Dir, BFull)
+	CRP  = os.path.join(LUT_Dir, CR)
+	CCAP = os.path.join(LUT_Dir, CCA)
+	CCVP = os.path.join(LUT_Dir, CCV)
+	CFP  = os.path.join(LUT_Dir, CFull)
+	IRP  = os.path.join(LUT_Dir, IR)
+	IFP  = os.path.join(LUT_Dir, IFull)
+	IEP  = os.path.join(LUT_Dir, IEconParams)
+	Debris = os.path.join(LUT_Dir,DebrisX)
+	Rest = os.path.join(LUT_Dir,RestFnc)
+
+	# Process the look-up tables into a list of Dictionary elements
+	# Note the standard (default) Lookup Tables were separately developed.
+	# Yes, they are a subset of the full lookup table
+	# The csv module reads everything as text. The numeric columns are converted once, on reading,
+	# rather than calling float() or int() on every LUT reference for every UDF record.
+	bddf_lut_riverine 	= _read_lut(BRP, DDF_Depths)
+	bddf_lut_coastalA 	= _read_lut(BCAP, DDF_Depths)
+	bddf_lut_coastalV 	= _read_lut(BCVP, DDF_Depths)
+	bddf_lut_full	 	= _read_lut(BFP, DDF_Depths)
+
+	cddf_lut_riverine 	= _read_lut(CRP, DDF_Depths)
+	cddf_lut_coastalA 	= _read_lut(CCAP, DDF_Depths)
+	cddf_lut_coastalV 	= _read_lut(CCVP, DDF_Depths)
+	cddf_lut_full	 	= _read_lut(CFP, DDF_Depths)
+
+	iddf_lut_riverine 	= _read_lut(IRP, DDF_Depths)
+	iddf_lut_full	 	= _read_lut(IFP, DDF_Depths)
+	# Yes, raw data is typically in Integer format, be flexible for future data which may be available in dollars.cents
+	iecon_lut			= _read_lut(IEP, ['AnnualSalesPerSqFt', 'BusinessInvPctofSales'])
+
+	debris_lut			= _read_lut(Debris, ['Finishes', 'Structure', 'Foundation'])
+	rest_lut			= _read_lut(Rest, integer=['Max_Depth', 'Min_Restor_Days', 'Max_Restor_Days'])
+
+	# Stack each library's full and default tables into one matrix, indexed by DDF ID and by SpecificOccupId.
+	# Used both for checking legitimate user-supplied DDF_ID values and for fetching the DDF itself.
+	bddf = _ddf_library(bddf_lut_full, 'BldgDmgFnID', bddf_lut_riverine, bddf_lut_coastalA, bddf_lut_coastalV)    # Yes, the capitalization is due to a quirk in the [dbo].[flBldgStructDmgFn].
+	cddf = _ddf_library(cddf_lut_full, 'ContDmgFnId', cddf_lut_riverine, cddf_lut_coastalA, cddf_lut_coastalV)  # Yes, the case is inconsistent with Building column name. That's the way the Hazus database is.
+	iddf = _ddf_library(iddf_lut_full, 'InvDmgFnId', iddf_lut_riverine)	# Inventory: there is no Coastal Flooding default table
+
+	# Inventory economic parameters keyed by Occupancy: (AnnualSalesPerSqFt, BusinessInvPctofSales)
+	iecon_by_occ = dict((lutrow['Occupancy'], (lutrow['AnnualSalesPerSqFt'], lutrow['BusinessInvPctofSales'])) for lutrow in iecon_lut)
+
+	# Debris rates as a matrix: one row per DebrisID stem (OccupancyClass + basement + foundation code), one column
+	# per depth breakpoint (DEBRIS_BREAKS, taken off the end of the DebrisID), then (Finishes, Structure, Foundation).
+	# NaN where the LUT has no entry; the last row stands for a stem that is not in the LUT.
+	debris_row = {}
+	debris_rates = []
+	for lutrow in debris_lut:
+		stem, dbin = re.match(r'(.*?)(-?\d+)$', lutrow['DebrisID']).groups()
+		if stem not in debris_row:
+			debris_row[stem] = len(debris_rates)
+			debris_rates.append(np.full((len(DEBRIS_BREAKS), 3), np.nan))
+		col = np.searchsorted(DEBRIS_BREAKS, int(dbin))
+		if col < len(DEBRIS_BREAKS) and DEBRIS_BREAKS[col] == int(dbin):	# Any other breakpoint can never be looked up
+			debris_rates[debris_row[stem]][col] = (lutrow['Finishes'], lutrow['Structure'], lutrow['Foundation'])
+	debris_rates = np.array(debris_rates + [np.full((len(DEBRIS_BREAKS), 3), np.nan)])
+	# Restoration days the same way: one row per Occupancy, one column per depth breakpoint (REST_BINS, the
+	# Max_Depth), then (Min_Restor_Days, Max_Restor_Days). -1 where the LUT has no entry.
+	rest_row = {}
+	rest_days = []
+	for lutrow in rest_lut:
+		if lutrow['Occupancy'] not in rest_row:
+			rest_row[lutrow['Occupancy']] = len(rest_days)
+			rest_days.append(np.full((len(REST_BINS), 2), -1, dtype=np.int32))
+		col = np.searchsorted(REST_BINS, lutrow['Max_Depth'])
+		if col < len(REST_BINS) and REST_BINS[col] == lutrow['Max_Depth']:
+			rest_days[rest_row[lutrow['Occupancy']]][col] = (lutrow['Min_Restor_Days'], lutrow['Max_Restor_Days'])
+	rest_days = np.array(rest_days + [np.full((len(REST_BINS), 2), -1, dtype=np.int32)])
+
+	return dict(bddf=bddf, cddf=cddf, iddf=iddf, iecon_by_occ=iecon_by_occ,
+		debris_row=debris_row, debris_rates=debris_rates, rest_row=rest_row, rest_days=rest_days)
+
+#########################################################################################################
+# Building, Content, Inventory Losses, Debris and Restoration Time for a set of UDF records, all at once.
+#   udf   the UDF attributes read from the Results file; bulk  the results of the bulk pass, see _process_one_grid.
+#			Its depth and costs are at full (float64) precision: rounded to the stored field types, a depth on a
+#			breakpoint could fall into the neighbouring DDF column or bin, and the losses would be off by a dollar.
+#   flags, luts   as for _process_one_grid
+#   first   the position of the first of these records in the Results file (for messages), when given a chunk
+# Each LUT lookup is done once per distinct combination of the attributes it depends on, then the
+# arithmetic is done on entire columns. Unexposed structures get values that clearly indicate No Exposure.
+# Returns the output fields (RESULT_DTYPE, but for GridName) keyed by UDF_OID, ready for ExtendTable, and the
+# warning and error messages for these records, for the script to pass on to ArcGIS.
+#########################################################################################################
+def _compute_losses(udf, bulk, LUT_Dir, flags, luts=None, first=0):
+	if luts is None:
+		luts = _load_luts(LUT_Dir)
+	bddf				= luts['bddf']
+	cddf				= luts['cddf']
+	iddf				= luts['iddf']
+	debris_row			= luts['debris_row']
+	debris_rates		= luts['debris_rates']
+	rest_row			= luts['rest_row']
+	rest_days			= luts['rest_days']
+
+	QC_Warning			= flags['QC_Warning']
+	CoastalZoneSupplied	= flags['CoastalZoneSupplied']
+	ubddf				= flags['ubddf']
+	ucddf				= flags['ucddf']
+	uiddf				= flags['uiddf']
+	nrec				= len(udf)
+	# Messages are collected here rather than sent to ArcGIS one record at a time
+	warnings			= []
+	errors				= []
+
+	OC_all = _strip_codes(udf[OccupancyClass])	# Occupancy Class sometimes has trailing spaces, due to Hazus processing quirks.
+	OC_unique, OC_index = np.unique(OC_all, return_inverse=True)
+	OWDI = np.array([oc in Inventory_List for oc in OC_unique], dtype=bool)[OC_index]	# OccupancyClass with Default Inventory
+	exposed = bulk[flExp] == 1		# flExp was set to 0 (Structure is NOT exposed) in the bulk pass
+	UID_all = udf[UserDefinedFltyId]   # Capture it for reporting purposes when encountering records with odd values.
+	area = udf[Area]    # Used in Inventory Loss Calculation
+	# Content and Inventory Cost were determined for each record in the bulk pass above, even if structure not exposed to flooding
+	ccost = bulk[ContentCostUSD]
+	icost = bulk[InventoryCostUSD]
+
+	# (To be considered: optional freeboard adjustment for Coastal Flooding)
+	# Hazus 4.0 model does *no* adjustment. Some have suggested that one should add a freeboard margin; e.g., adjust FFH by -1 foot.
+	# But there is no clear consensus on such a conservative adjustment.
+	#
+	# If depth is over 24 feet or less than -4 feet, then adjust depth. LUTs do not extend beyond that range!
+	# Note that Hazus-MH flood model caps the grid raster at 24 feet, then does the subtraction. This creates some differences in results.
+	# We believe that you do the FFH subtraction before capping the depth at 24 feet.
+	# DDF columns on either side of the depth, and the fractional amount of depth, for interpolation. See DDF_Depths.
+	depth, col_lo, col_hi, frac = _depth_columns(bulk[Depth_in_Struc])
+
+	# Get some basic information for the records
+	# One could insert some quality checks here and revert to a default if an illegal OccupancyClass, FoundationType, or NumStories
+	# At minimum, clean up the codes. These sometimes have trailing spaces, due to Hazus processing quirks. (OccupancyClass: see above)
+	fnd_all = _strip_codes(udf[FoundationType])
+	combos, index = _unique_rows(OC_all, fnd_all, udf[NumStories])
+	SOID_all = np.array([_specific_occup_id(*combo) for combo in combos])[index]
+
+	# Change the default DDF table only if Coastal Zone is defined (CoastalZoneSuppled) AND a legitimate Coastal Zone Code (CAE, V, VE)
+	# As of Hazus 4.0, Coastal lookup tables are only applicable for RES-type structures.
+	if CoastalZoneSupplied:
+		zone_all = np.where(np.char.startswith(OC_all, 'RES'), _strip_codes(udf[flC]), '')
+	else:
+		zone_all = np.full(nrec, '')
+	# User-specified DDF IDs. Due to Hazus-MH Flood definitions, these are Text type.
+	nobid = np.full(nrec, '')
+	BID_B = udf[BldgDamageFnID].astype('U') if ubddf else nobid
+	BID_C = udf[ContDamageFnId].astype('U') if ucddf else nobid
+	BID_I = udf[InvDamageFnId].astype('U') if uiddf else nobid
+
+	results = np.zeros(nrec, dtype=[("UDF_OID", np.int32)] + RESULT_DTYPE)
+	results["UDF_OID"] = bulk["UDF_OID"]
+	results[SOID] = SOID_all
+
+	###########################################################
+	# BUILDING LOSS CALCULATION
+	###########################################################
+	# Did user specify a Building DDF? If so, and it is defined, then assume they know what is best, and use the full lookup table.
+	# Else use the Default LUT.
+	damage, ddf_id, found, full = _loss_ddf('Building', bddf, BID_B, SOID_all, zone_all, col_lo, col_hi, frac, exposed, OC_all, UID_all, QC_Warning, warnings)
+	for i in np.flatnonzero(exposed & ~found)[:1]:
+		# This should not occur
+		raise HazusLookupError("something wrong, no match for Specific Occupancy ID :" + SOID_all[i] + "   UDF: " + str(UID_all[i]), warnings, errors)
+
+	# Calculate building loss, set other attributes
+	results[BDDF_ID] = ddf_id
+	results[BldgDmgPct] = damage*100  # Hazus convention: percentage
+	results[BldgLossUSD] = np.rint(damage * udf[Cost])
+
+	###########################################################
+	# CONTENT LOSS CALCULATION
+	###########################################################
+	# Did user specify a Content DDF? If so, use that to reference the Full LUT, else use the Default LUT.
+	damage, ddf_id, found, full = _loss_ddf('Content', cddf, BID_C, SOID_all, zone_all, col_lo, col_hi, frac, exposed, OC_all, UID_all, QC_Warning, warnings)
+	missing = exposed & ~found
+	for i in np.flatnonzero(missing):
+		# This should not occur
+		errors.append("something wrong for Content lookup, no match for Specific Occupancy ID :" + SOID_all[i] + "   Counter:" + str(first + i + 1))
+		warnings.append("Problem with Content Loss: nothing matches the SpecificOccupId of " + SOID_all[i] + "Check entry " + str(first + i + 1) + " with " + OC_all[i] + " " + str(udf[NumStories][i]))
+	damage[missing] = 0
+
+	results[CDDF_ID] = np.where(missing, '-9999', ddf_id)	# -9999: Flag value for the CDDF_ID attribute
+	results[ContDmgPct] = damage*100   # Hazus convention: percenage
+	results[ContentLossUSD] = np.rint(damage*ccost)
+
+	###########################################################
+	# INVENTORY LOSS CALCULATION
+	###########################################################
+	# Did user specify an Inventory DDF? If so, use that to reference the Full LUT, else use the Default LUT.
+	# Inventory: There is no Coastal Flooding default table to use
+	damage, ddf_id, found, full = _loss_ddf('Inventory', iddf, BID_I, SOID_all, nobid, col_lo, col_hi, frac, exposed, OC_all, UID_all, QC_Warning, warnings)
+	# Default Inventory DDF defined only for a subset of OccupancyClass types (OWDI)
+	for i in np.flatnonzero(exposed & ~full & OWDI & ~found)[:1]:
+		# This should not occur
+		raise HazusLookupError("something wrong for Inventory lookup, no match for Specific Occupancy ID :" + SOID_all[i] + "   Counter:" + str(first + i + 1), warnings, errors)
+	# No default DDF ID exists for the other OccupancyClasses. Fill them in with zeros
+	has_ddf = full | OWDI
+	damage[~has_ddf] = 0
+
+	results[IDDF_ID] = np.where(has_ddf, ddf_id, '0')
+	results[InvDmgPct] = damage*100  # Hazus convention - percentage
+	# Inventory Loss in US$: depends if user supplied an inventory cost field, and if it is > 0.
+	# If not supplied, or 0, then use the default value based on OccupancyClass and Square Footage
+	# per Hazus-MH Flood Technical Manual table - see the bulk pass.
+	results[InventoryLossUSD] = np.rint(damage * icost)
+
+	###########################################################
+	# DEBRIS CALCULATIONS
+	###########################################################
+	# Calculate only for exposed buildings
+	# Build up a DebrisID key for accessing Debris LUT table
+	# Basement/No Basement only defined for RES1.
+	# Slab/Footing: Simple mapping of FoundationType (includes Basement by definition)
+	# SG: Slab on Grade.  FT = ???? DEFINE THIS - FROM BBOHN.
+	# Flood depth key (the breakpoint at or below the depth) varies, depending if it's a RES1/Basement.
+	# The key's stem depends only on (OccupancyClass, FoundationType), so it is built, and resolved to its row of the
+	# rate matrix, once per distinct pair. The breakpoint is a column index. No key strings are built per record.
+	combos, index = _unique_rows(OC_all, fnd_all)
+	stems = []
+	res1b = np.zeros(len(combos), dtype=bool)
+	for i, (oc, fnd) in enumerate(combos):
+		res1b[i] = oc == 'RES1' and fnd == '4'
+		stems.append(oc + ('B' if res1b[i] else 'NB') + ('SG' if fnd in ('4', '7') else 'FT'))
+	row = np.array([debris_row.get(stem, len(debris_rates) - 1) for stem in stems], dtype=np.intp)[index]
+	res1b = res1b[index]
+	dbin = np.where(res1b, _bin_at_or_below(DEBRIS_BINS_RES1B, depth), _bin_at_or_below(DEBRIS_BINS, depth))
+	rates = debris_rates[row, np.searchsorted(DEBRIS_BREAKS, dbin)]
+	# The DebrisID itself (also an output) once per distinct (stem, breakpoint)
+	keys, kindex = _unique_rows(index, dbin)
+	debriskey = np.array([stems[k] + str(b) for k, b in keys])[kindex]
+	missing = np.isnan(rates[:, 0])
+	for i in np.flatnonzero(exposed & missing):
+		warnings.append("No Debris LUT entry " + debriskey[i] + " for UDF " + str(UID_all[i]) + "; Debris set to 0")
+	rates[missing] = 0
+	# All LUT numbers are in tons per 1000 square feet, so adjust for your particular structure
+	dfin		= area * rates[:, 0] / 1000
+	dstruc		= area * rates[:, 1] / 1000
+	dfound		= area * rates[:, 2] / 1000
+	dtot		= dfin + dstruc + dfound
+
+	results[DebrisID] = debriskey
+	results[Debris_Fin] = np.rint(dfin)
+	results[Debris_Struc] = np.rint(dstruc)
+	results[Debris_Found] = np.rint(dfound)
+	results[Debris_Tot] = np.rint(dtot)
+
+	###########################################################
+	# Restoration Time Calculation - the basis for all Direct Economic Loss numbers
+	# Based on the Min and Max days listed in   [dbo].[flRsFnGBS]
+	# Note how the table differs slightly from the TM, esp with Res with basements
+	# Note that the TM suggests some of these are not subject to a 10% threshold
+	# The method suggests using the Maximum; for completeness, the script produces both.
+	###########################################################
+	# Calculate only for exposed buildings.
+	# Look up the Restoration Time LUT by OccupancyClass and depth breakpoint (RestFnID = OC + breakpoint)
+	dbin = _bin_above(REST_BINS, depth)
+	row = np.array([rest_row.get(oc, len(rest_days) - 1) for oc in OC_unique], dtype=np.intp)[OC_index]
+	days = rest_days[row, np.searchsorted(REST_BINS, dbin)]	# flRsFnGBS has a min and a max days out
+	missing = days[:, 0] == -1
+	for i in np.flatnonzero(exposed & missing):
+		warnings.append("No Restoration Time LUT entry " + OC_all[i] + str(dbin[i]) + " for UDF " + str(UID_all[i]) + "; days set to 0")
+	days[missing] = 0
+	results[Restor_Days_Min] = days[:, 0]
+	results[Restor_Days_Max] = days[:, 1]
+
+	# Every output above was calculated for all records. If no depth was measured for a record, overwrite its outputs,
+	# in one pass at the end, with values that clearly indicate that there is No Exposure.
+	unexposed = np.flatnonzero(~exposed)
+	for field, value in NO_EXPOSURE:
+		results[field][unexposed] = value
+
+	return results, warnings, errors
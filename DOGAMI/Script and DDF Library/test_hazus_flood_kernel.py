@@ -0,0 +1,109 @@
+# Checks of the loss calculation in hazus_flood_kernel.py, run against the DDF library shipped next to it.
+# No ArcGIS needed: the UDF records are made up here in the form _process_one_grid reads them.
+import os, csv, math, shutil, multiprocessing
+from concurrent import futures
+
+import numpy as np
+import pytest
+
+import hazus_flood_kernel as k
+
+LUT_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DDF_Hazus4p0_LookupTables')
+FLAGS = dict(QC_Warning=True, CoastalZoneSupplied=0, ubddf=1, ucddf=0, uiddf=0, uccost=0, uicost=0)
+
+@pytest.fixture
+def lut_dir(tmp_path):
+	# A copy, so the LUT cache is written under tmp_path rather than into the library
+	return shutil.copytree(LUT_SRC, str(tmp_path / 'luts'))
+
+def make_records(n, seed=0):
+	rng = np.random.RandomState(seed)
+	udf = np.zeros(n, dtype=[(k.UserDefinedFltyId, 'i4'), (k.Depth_Grid, 'f8'), (k.FirstFloorHt, 'f8'), (k.OccupancyClass, 'U8'),
+		(k.FoundationType, 'U2'), (k.NumStories, 'i2'), (k.Cost, 'f8'), (k.Area, 'f8'), (k.BldgDamageFnID, 'U6')])
+	udf[k.UserDefinedFltyId] = np.arange(n)
+	udf[k.Depth_Grid] = np.where(rng.rand(n) < 0.1, -9999, rng.uniform(-6, 30, n))
+	udf[k.FirstFloorHt] = rng.choice([0, 1, 2.5, 4], n)
+	udf[k.OccupancyClass] = rng.choice(['RES1', 'RES2', 'RES3A ', 'COM1', 'IND2', 'AGR1', 'EDU1'], n)
+	udf[k.FoundationType] = rng.choice(['4', '7', '5'], n)
+	udf[k.NumStories] = rng.choice([1, 2, 3, 5], n)
+	udf[k.Cost] = rng.uniform(50000, 500000, n).round()
+	udf[k.Area] = rng.uniform(800, 5000, n).round()
+	udf[k.BldgDamageFnID] = rng.choice(['', '', '105', 'N/A', '99999'], n)
+	return udf
+
+def bulk_pass(udf):
+	# As _process_one_grid does, before the losses are calculated
+	n = len(udf)
+	OC = k._strip_codes(udf[k.OccupancyClass])
+	cmult = np.array([k.CMULT_BY_OC.get(oc, 0.0) for oc in OC])
+	owdi = np.array([oc in k.Inventory_List for oc in OC], dtype=bool)
+	depth, exposed, ccost, icost = k._compute_rows(udf[k.Depth_Grid], udf[k.FirstFloorHt], udf[k.Cost],
+		np.full(n, -1.0), np.full(n, -1.0), udf[k.Area], cmult, owdi, np.full(n, 100.0), np.full(n, 10.0))
+	bulk = np.empty(n, dtype=[("UDF_OID", np.int32), (k.Depth_in_Struc, np.float64), (k.flExp, np.int16),
+		(k.ContentCostUSD, np.float64), (k.InventoryCostUSD, np.float64)])
+	bulk["UDF_OID"] = np.arange(1, n + 1)
+	bulk[k.Depth_in_Struc] = depth
+	bulk[k.flExp] = exposed
+	bulk[k.ContentCostUSD] = ccost
+	bulk[k.InventoryCostUSD] = icost
+	return bulk
+
+def test_chunks_in_worker_processes_match_serial(lut_dir):
+	udf = make_records(3000)
+	bulk = bulk_pass(udf)
+	serial, warnings, errors = k._compute_losses(udf, bulk, lut_dir, FLAGS, k._load_luts(lut_dir))
+
+	# As _process_one_grid splits the records. spawn, as on Windows: the workers import hazus_flood_kernel afresh
+	bounds = [0, 1000, 2000, 3000]
+	first, last = bounds[:-1], bounds[1:]
+	with futures.ProcessPoolExecutor(max_workers=3, mp_context=multiprocessing.get_context('spawn')) as ex:
+		parts = list(ex.map(k._compute_losses, [udf[a:b] for a, b in zip(first, last)], [bulk[a:b] for a, b in zip(first, last)],
+			[lut_dir]*3, [FLAGS]*3, [None]*3, first))
+
+	assert np.array_equal(np.concatenate([part[0] for part in parts]), serial)
+	# Each chunk groups its messages by kind, so the order differs; the messages themselves do not
+	assert sorted(msg for part in parts for msg in part[1]) == sorted(warnings)
+	assert sorted(msg for part in parts for msg in part[2]) == sorted(errors)
+	assert any('not an integer: N/A' in msg for msg in warnings)
+
+def test_lookup_error_carries_messages_across_processes(lut_dir):
+	udf = make_records(50)
+	udf[k.OccupancyClass][-1] = 'XYZ9'	# No default DDF for it
+	udf[k.Depth_Grid][-1] = 10
+	bulk = bulk_pass(udf)
+	with futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as ex:
+		with pytest.raises(k.HazusLookupError) as info:
+			ex.submit(k._compute_losses, udf, bulk, lut_dir, FLAGS).result()
+	assert 'no match' in str(info.value)
+	assert any('not an integer' in msg for msg in info.value.warnings)	# Found before the failing record, and not lost
+
+def original_damage(ddf_row, depth):
+	# The original script's per-record interpolation: csv text through float(), between the whole-foot columns
+	depth = min(max(depth, -4.0), 24.0)
+	lo, hi = math.floor(depth), math.ceil(depth)
+	d_lower = float(ddf_row[k.DDF_Depths[int(lo) + 4]])
+	d_upper = float(ddf_row[k.DDF_Depths[int(hi) + 4]])
+	return (d_lower + (depth - lo)*(d_upper - d_lower))/100
+
+def test_dollar_losses_match_original_script(lut_dir):
+	# One-story RES1 without basement: Building DDF 105 from the full library, Content from the default R11N
+	with open(os.path.join(lut_dir, k.BFull)) as fh:
+		bddf = next(row for row in csv.DictReader(fh) if row['BldgDmgFnID'] == '105')
+	with open(os.path.join(lut_dir, k.CR)) as fh:
+		cddf = next(row for row in csv.DictReader(fh) if row['SpecificOccupId'] == 'R11N')
+	udf = make_records(400, seed=1)
+	udf[k.OccupancyClass] = 'RES1'
+	udf[k.FoundationType] = '7'
+	udf[k.NumStories] = 1
+	udf[k.BldgDamageFnID] = '105'
+	udf[k.Depth_Grid] = np.random.RandomState(2).uniform(-3, 26, len(udf)).round(3)
+	udf[k.Cost] = np.random.RandomState(3).uniform(10000, 900000, len(udf)).round(2)
+	bulk = bulk_pass(udf)
+	results, warnings, errors = k._compute_losses(udf, bulk, lut_dir, FLAGS)
+
+	for i, rec in enumerate(udf.tolist()):
+		depth = rec[1] - rec[2]
+		cost = rec[6]
+		# setValue rounds a float into a LONG field
+		assert results[k.BldgLossUSD][i] == round(original_damage(bddf, depth) * cost)
+		assert results[k.ContentLossUSD][i] == round(original_damage(cddf, depth) * cost * 0.5)
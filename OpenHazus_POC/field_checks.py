@@ -0,0 +1,110 @@
+# Field mapping checks shared by the two forms, gui_program and gui_process
+from tkinter import *
+
+_LISTBOX_FIELDS = ('Depth Grid (ft)*','Coastal Flooding attribute (flC)*','Hazard-Type*')# Chosen from a list, not mapped to a csv field
+
+def normalize(name):# Header names are matched ignoring case, surrounding blanks and space/underscore differences
+    return name.strip().lower().replace(' ','_')
+
+def normalize_defaults(defaultFields):# Default names per field, normalized once; spellings that normalize alike are kept once
+    return {key:tuple(dict.fromkeys(normalize(name) for name in names)) for key, names in defaultFields.items()}
+
+def header_map(csvFields):# Normalized name -> header name; the first of any duplicates wins
+    return {normalize(name):name for name in reversed(csvFields)}
+
+def field_spec(fields, defaultFields):# Worked out once for a form rather than on every check
+    required = frozenset(key for key, field in fields.items() if '*' in field)
+    # Entry boxes as (key, field, required, normalized default names), also by key; list boxes as key -> field
+    entries = tuple((key, field, key in required, defaultFields.get(key, ())) for key, field in fields.items() if field not in _LISTBOX_FIELDS)
+    listboxes = {key:field for key, field in fields.items() if field in _LISTBOX_FIELDS}
+    return entries, {spec[0]:spec for spec in entries}, listboxes
+
+# The checks keep their state on the form's Tk root, set up by init_form. The form adds
+#   ents: entry and list boxes by field, made with entry_box and list_box; entry_box fills in vars, the text of each entry box
+#   runButton, runCommand: the button enabled once every required field is mapped, and what it runs
+def init_form(root, fields, defaultFields, choices):# choices: for a list box field, the value each choice stands for, if not the choice itself
+    root.csvFields = []# Input csv file fields
+    root.csvFieldsLower = {}
+    root.fields = {key:'' for key in fields}# Mapped csv field or list box value, by key
+    root.spec = field_spec(fields, defaultFields)
+    root.valid = {spec[1]:False for spec in root.spec[0] if spec[2]}# Required entries, whether mapped
+    root.invalid = len(root.valid)# Required entries not yet mapped, kept up to date by check_entry
+    root.choices = choices
+    root.buttonfg = None
+    root.pending = set()# Entries changed since the last check
+    root.colors = {}# Background color each entry was last given
+    root.vars = {}# Text of each entry box
+
+def check_entry(root, key, field, required, defaults):# Check validity of one entry box
+    root.fields[key] = ''
+    color = "red" if required else "yellow"
+    ent = root.ents[field]
+    value = root.vars[field].get()
+    if len(root.csvFields) == 0:
+        color = None# If no input file is selected there is no coloring.
+    else:
+        if value != '': name = root.csvFieldsLower.get(normalize(value))
+        else: name = next((root.csvFieldsLower[d] for d in defaults if d in root.csvFieldsLower), None)
+        if name is not None:
+            root.fields[key] = name
+            color = "green"
+    if required and root.valid[field] != (root.fields[key] != ''):# Keep count of the required entries not yet mapped
+        root.valid[field] = not root.valid[field]
+        root.invalid += -1 if root.valid[field] else 1
+    if root.colors.get(field) != color:# Only go through Tk when the color changes
+        ent.config(background=color)
+        root.colors[field] = color
+
+def check_listbox(root, key, field):# Record the selection of a list box
+    ent = root.ents[field]
+    choice = ent.get(ent.curselection())
+    root.fields[key] = root.choices[field][choice] if field in root.choices else choice
+
+def validate_one(root, key):# Check validity of one form entry
+    entries, entry_spec, listboxes = root.spec
+    if key in entry_spec: check_entry(root, *entry_spec[key])
+    else: check_listbox(root, key, listboxes[key])
+
+def schedule_check(root, key):# Called when an entry changes. Checked once Tk is idle, so a burst of keystrokes is checked once
+    if not root.pending: root.after_idle(run_checks, root)
+    root.pending.add(key)
+
+def run_checks(root):
+    for key in root.pending: validate_one(root, key)
+    root.pending.clear()
+    checkbutton(root)
+
+def checkbutton(root):# The run button is only enabled once every required field is mapped
+    fg = 'black' if root.invalid == 0 else 'grey'
+    if fg != root.buttonfg:
+        root.runButton.config(fg=fg, command=root.runCommand if fg == 'black' else '')
+        root.buttonfg = fg
+
+def checkform(root):# Check validity of all form entries: at startup and when a new input file is selected
+    entries, entry_spec, listboxes = root.spec
+    for spec in entries: check_entry(root, *spec)
+    for key, field in listboxes.items(): check_listbox(root, key, field)
+    checkbutton(root)
+
+def entry_box(root, parent, key, field):# Entry box, validated when its text changes, by typing, pasting or otherwise, rather than by polling it
+    root.vars[field] = var = StringVar()
+    ent = Entry(parent, textvariable=var)
+    var.trace_add('write', lambda *a: schedule_check(root, key))
+    return ent
+
+def list_box(root, parent, key, choices, **options):# List box of choices with the first selected, checked when the selection changes
+    ent = Listbox(parent, exportselection=0, **options)
+    for num, choice in enumerate(choices): ent.insert(num, choice)
+    ent.selection_set(0)
+    ent.bind('<<ListboxSelect>>', lambda e: schedule_check(root, key))
+    return ent
+
+def popupmsg(root, msg):# A window of the main Tk instance, served by its mainloop, rather than a second Tk with its own
+    popup = Toplevel(root)
+    popup.wm_title("Program Run")
+    popup.transient(root)
+    label = Label(popup, text=msg)
+    label.pack(side=TOP, fill=X, padx=5, pady=10)
+    B1 = Button(popup, text="Okay", command = popup.destroy)
+    B1.pack(side=BOTTOM, padx=5, pady=5)
+    popup.grab_set()
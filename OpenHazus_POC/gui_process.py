@@ -1,6 +1,6 @@
 from tkinter import *
 from tkinter import filedialog
-import pre_process,os, csv
+import pre_process,os, csv, field_checks, logging
 from os import listdir
 from os.path import isfile, join
 
@@ -15,17 +15,14 @@ defaultFields = {'OCC':['Occupancy','Occ'], \
 				 'BDDF_ID':['BuildingDDF','BDDF_ID','BldgDamageFnID'], \
 				 'CDDF_ID':['ContentDDF','CDDF_ID','ContDamageFnId'], \
 				 'IDDF_ID':['InventoryDDF','IDDF_ID','InvDamageFnId']}
+defaultFields = field_checks.normalize_defaults(defaultFields)
 
 def runHazus():
-     entries = []
-     print(fields)
-     entries.extend(root.fields.values())
-     
-     print(entries)
+     entries = list(root.fields.values())# Mapped field names, in the order of fields
      haz = pre_process.process(root.filename, entries)# Run the Hazus script with input from user using the GUI
 
      print('Pre-Process RUN',haz,entries)
-     if haz[0]: popupmsg(str(haz[1][0])+' records sucessfully processed of ' + str(haz[1][1]) + ' records total.\n' \
+     if haz[0]: field_checks.popupmsg(root, str(haz[1][0])+' records sucessfully processed of ' + str(haz[1][1]) + ' records total.\n' \
          +str(haz[2][1])+' Building DDFs assigned.\n' \
          +str(haz[2][2])+' Content DDFs assigned.\n' \
          +str(haz[2][3])+' Inventory DDFs assigned.\n' \
@@ -36,26 +33,26 @@ def runHazus():
 
 def browse_button():
      root.filename = filedialog.askopenfilename(initialdir = "/",title = "Select file",filetypes = (("csv files","*.csv"),("all files","*.*")))# Gets input csv file from user
-     # Gets field names from input csv file and makes a list
-     with open(root.filename, "r+") as f:
-          reader = csv.reader(f)
-          root.csvFields = next(reader)
+     # Gets field names from input csv file and makes a list. Only the header line is read; utf-8-sig drops the byte order mark Excel writes
+     with open(root.filename, 'rb') as f:
+          first = f.readline().decode('utf-8-sig').rstrip('\r\n')
+     root.csvFields = next(csv.reader([first]), [])
+     root.csvFieldsLower = field_checks.header_map(root.csvFields)
      print(root.filename,root.csvFields)
+     field_checks.checkform(root)# New field names, so recheck every entry
 
 def makeform(root, fields):# Assemble and format the fields to map from the list of fields
     entries = {}
     
-    for field in fields.values():# Make entry box for each field
+    for key, field in fields.items():# Make entry box for each field
         row = Frame(root)
         lab = Label(row, width=22, text=field+": ", anchor='w')
              
         if field == 'Hazard-Type*':
-             ent = Listbox(row,exportselection=0)
-             for num, hazardType in enumerate(hazardTypes.keys()): ent.insert(num, hazardType)
-             ent.selection_set(0)
+             ent = field_checks.list_box(root, row, key, hazardTypes.keys())
              
         else:
-             ent = Entry(row)
+             ent = field_checks.entry_box(root, row, key, field)
              
         row.pack(side=TOP, fill=X, padx=5, pady=5)
         lab.pack(side=LEFT)
@@ -63,51 +60,11 @@ def makeform(root, fields):# Assemble and format the fields to map from the list
         entries[field] = ent  
     return entries
 
-def checkform():# Check validity of form entries
-    root.fields = {key:''for key, value in fields.items()}
-    for key, field in fields.items():
-         if field != 'Hazard-Type*':# Not needed for raster input box
-              color = "yellow" if '*' not in field else "red"
-              ent = ents[field]
-              value = ent.get()
-              if '*' in field: root.valid[field] = False
-              if len(root.csvFields) == 0:
-                    color = None# If no input file is selected there is no coloring.
-              elif value != '':
-                    if value in root.csvFields:
-                         root.fields[key] = value
-                         color = "green"
-                         if '*' in field: root.valid[field] = True
-              else:
-                    for defaultField in defaultFields[key]:
-                         if defaultField in root.csvFields:
-                              root.fields[key] = root.csvFields[root.csvFields.index(defaultField)]
-                              color = "green"
-                              if '*' in field: root.valid[field] = True
-                              break
-              ent.config(background=color)
-         
-         else: root.fields[key] = hazardTypes[ents['Hazard-Type*'].get(ents['Hazard-Type*'].curselection())]
-         
-    if False in root.valid.values(): b1.config(fg='grey',command='')
-    else: b1.config(fg='black', command=runHazus)
-    root.after(100, checkform)#Recheck fields every 0.1 second
-
-def popupmsg(msg):
-    popup = Tk()
-    popup.wm_title("Program Run")
-    label = Label(popup, text=msg)
-    label.pack(side=LEFT)
-    B1 = Button(popup, text="Okay", command = popup.destroy)
-    B1.pack(side=BOTTOM, padx=5, pady=5)
-    popup.mainloop()
-                  
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')# Show pre_process progress and totals on the console, as its prints did
     root = Tk()
-    root.csvFields = []# Input csv file fields
-    root.fields = {key:''for key, value in fields.items()}
-    root.valid = {}
-    ents = makeform(root, fields)
+    field_checks.init_form(root, fields, defaultFields, {'Hazard-Type*':hazardTypes})
+    root.ents = makeform(root, fields)
     lab = Label(root, text="* indicates required field.")
     lab.pack()
     lab = Label(root, text="Red fields are required and must be mapped.")
@@ -122,5 +79,6 @@ if __name__ == '__main__':
     b2.pack(side=LEFT, padx=5, pady=5)
     b3 = Button(root, text='Quit', command=root.quit)
     b3.pack(side=LEFT, padx=5, pady=5)
-    root.after(100, checkform)# Recheck fields every 0.1 second
+    root.runButton, root.runCommand = b1, runHazus
+    field_checks.checkform(root)# Entries are rechecked as they change, see makeform
     root.mainloop()
\ No newline at end of file
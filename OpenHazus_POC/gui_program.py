@@ -1,14 +1,13 @@
 from tkinter import *
 from tkinter import filedialog
-import hazus,os, csv
-from os import listdir
-from os.path import isfile, join
+import hazus,os, csv, field_checks
 
 dir = os.getcwd()
 #dir = os.path.dirname(dir)
 cwd = os.path.join(dir,'rasters')# Default raster directory
 hazardTypes = {'Riverine':'HazardRiverine','CoastalV':'V','CoastalA':'CAE'}
-rasters = [f for f in listdir(cwd) if isfile(join(cwd, f)) and f.endswith('.tif')]# Search rasters folder for all .tif files and make a list
+with os.scandir(cwd) as it:# Search rasters folder for all .tif files and make a list. The directory read gives each entry's type, so no stat per file
+     rasters = [e.name for e in it if e.name.endswith('.tif') and e.is_file()]
 print('Rasters selection ',rasters)
 #hazardTypes = {'Riverine':'HazardR','CoastalA':'HazardCA','CoastalB':'HazardCV'}
 #fields = ['Occupancy*','NumStories*','SpecificOcc_ID','BuildingDDF','ContentDDF','InventoryDDF','Hazard-Type*']# Fields for custom input
@@ -46,11 +45,10 @@ defaultFields = {'OCC':['Occupancy','Occ'],
                       'FirstFloorHt':['FirstFloorHt'],
                       'Latitude':['Latitude','latitude','LATITUDE',],
                       'Longitude':['Longitude','longitude','LONGITUDE']}
+defaultFields = field_checks.normalize_defaults(defaultFields)
 
 def runHazus():
-     entries = []
-     print(fields)
-     entries.extend(root.fields.values())
+     entries = list(root.fields.values())# Mapped field names, in the order of fields
      #entries.append(ents['Hazard-Type*'].get(ents['Hazard-Type*'].curselection()))
      """
      for num, ent in enumerate(ents):# Construct a list for field names and their values for field mapping 
@@ -59,39 +57,36 @@ def runHazus():
           #else:
                 #entries.append([fields[num],ents[fields[num]].get()])
      """
-     print(entries)
      haz = hazus.local(root.filename, entries)# Run the Hazus script with input from user using the GUI
      print('Run Hazus',haz,entries)
-     if haz[0]:popupmsg(str(haz[1][0])+' records processed of ' + str(haz[1][1]) + ' records total.\n' + 'File saved to: ' + os.path.dirname(root.filename))
-     else: popupmsg('Processing Failed. See log for details.')
+     if haz[0]:field_checks.popupmsg(root, str(haz[1][0])+' records processed of ' + str(haz[1][1]) + ' records total.\n' + 'File saved to: ' + os.path.dirname(root.filename))
+     else: field_checks.popupmsg(root, 'Processing Failed. See log for details.')
 def browse_button():
      root.filename = filedialog.askopenfilename(initialdir = "/",title = "Select file",filetypes = (("csv files","*.csv"),("all files","*.*")))# Gets input csv file from user
-     # Gets field names from input csv file and makes a list
-     with open(root.filename, "r+") as f:
-          reader = csv.reader(f)
-          root.csvFields = next(reader)
+     # Gets field names from input csv file and makes a list. Only the header line is read; utf-8-sig drops the byte order mark Excel writes
+     with open(root.filename, 'rb') as f:
+          first = f.readline().decode('utf-8-sig').rstrip('\r\n')
+     root.csvFields = next(csv.reader([first]), [])
+     root.csvFieldsLower = field_checks.header_map(root.csvFields)
      print(root.filename,root.csvFields)
+     field_checks.checkform(root)# New field names, so recheck every entry
 
 def makeform(root, fields):# Assemble and format the fields to map from the list of fields
     entries = {}
     
-    for field in fields.values():# Make entry box for each field
+    for key, field in fields.items():# Make entry box for each field
         row = Frame(root)
         lab = Label(row, width=30, text=field+": ", anchor='w')
              
         if field == 'Depth Grid (ft)*':
-             ent = Listbox(row,exportselection=0, height = 3)
-             for num, raster in enumerate(rasters): ent.insert(num, raster)
-             ent.selection_set(0)
+             ent = field_checks.list_box(root, row, key, rasters, height = 3)
              
         elif field == 'Coastal Flooding attribute (flC)*':
-             ent = Listbox(row,exportselection=0, height = 3)
-             for num, hazardType in enumerate(hazardTypes.keys()): ent.insert(num, hazardType)
-             ent.selection_set(0)
+             ent = field_checks.list_box(root, row, key, hazardTypes.keys(), height = 3)
 
      
         else:
-             ent = Entry(row)
+             ent = field_checks.entry_box(root, row, key, field)
              
         row.pack(side=TOP, fill=X, padx=5, pady=5)
         lab.pack(side=LEFT)
@@ -99,54 +94,11 @@ def makeform(root, fields):# Assemble and format the fields to map from the list
         entries[field] = ent  
     return entries
 
-def checkform():# Check validity of form entries
-    root.fields = {key:''for key, value in fields.items()}
-    for key, field in fields.items():
-         if field != 'Depth Grid (ft)*' and field != 'Coastal Flooding attribute (flC)*':# Not needed for raster input box
-              color = "yellow" if '*' not in field else "red"
-              ent = ents[field]
-              value = ent.get()
-              if '*' in field: root.valid[field] = False
-              if len(root.csvFields) == 0:
-                    color = None# If no input file is selected there is no coloring.
-              elif value != '':
-                    if value in root.csvFields:
-                         root.fields[key] = value
-                         color = "green"
-                         if '*' in field: root.valid[field] = True
-              else:
-                    for defaultField in defaultFields[key]:
-                         if defaultField in root.csvFields:
-                              root.fields[key] = root.csvFields[root.csvFields.index(defaultField)]
-                              color = "green"
-                              if '*' in field: root.valid[field] = True
-                              break
-              ent.config(background=color)
-              
-         elif field == 'Coastal Flooding attribute (flC)*': root.fields[key] = hazardTypes[ents[field].get(ents[field].curselection())]   
-         else: root.fields[key] = ents[field].get(ents[field].curselection())
-         
-    
-    if False in root.valid.values(): b1.config(fg='grey',command='')
-    else: b1.config(fg='black', command=runHazus)
-    root.after(100, checkform)#Recheck fields every 0.1 second
-    
-def popupmsg(msg):
-    popup = Tk()
-    popup.wm_title("Program Run")
-    label = Label(popup, text=msg)
-    label.pack(side="top", fill="x", pady=10)
-    B1 = Button(popup, text="Okay", command = popup.destroy)
-    B1.pack()
-    popup.mainloop()
-    
 if __name__ == '__main__':
     root = Tk()
-    root.csvFields = []# Input csv file fields
-    root.fields = {key:''for key, value in fields.items()}
-    root.valid = {}
+    field_checks.init_form(root, fields, defaultFields, {'Coastal Flooding attribute (flC)*':hazardTypes})
     
-    ents = makeform(root, fields)
+    root.ents = makeform(root, fields)
     
     lab = Label(root, text="Fields named similar to defaults are searched for.")
     lab.pack()
@@ -166,5 +118,6 @@ if __name__ == '__main__':
     b3.pack(side=LEFT, padx=5, pady=5)
     
     
-    root.after(100, checkform)# Recheck fields every 0.1 second
+    root.runButton, root.runCommand = b1, runHazus
+    field_checks.checkform(root)# Entries are rechecked as they change, see makeform
     root.mainloop()
\ No newline at end of file
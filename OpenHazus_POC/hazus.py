@@ -61,10 +61,41 @@
 # ---------------------------------------------------------------------------
 
 # Variations between systems; some import these by default, others don't. Be explicit.
-import os,csv,sys,time,math,datetime,subprocess,numpy as np, utm
+import os,csv,sys,time,math,datetime,subprocess,codecs,numpy as np, utm
 from osgeo import gdal, osr, gdal_array
 gdal.SetCacheMax(2**30*5)
 
+#########################################################################################################
+# Depth grid values by pixel row and column. The grid is read one native block at a time, the first time
+# a UDF point falls in that block, so only the blocks holding UDF points are ever read.
+#########################################################################################################
+def raster_blocks(band):
+    bx, by = band.GetBlockSize()
+    xsize, ysize = band.XSize, band.YSize# Asked of GDAL once, not for every point
+    blocks = {}
+    def value(roww, col):
+        if not (0 <= roww < ysize and 0 <= col < xsize):
+            raise IndexError("UDF point falls outside the depth grid")
+        key = (roww // by, col // bx)
+        block = blocks.get(key)
+        if block is None:
+            xoff, yoff = key[1]*bx, key[0]*by
+            block = blocks[key] = band.ReadAsArray(xoff, yoff, min(bx, xsize - xoff), min(by, ysize - yoff))
+        return block[roww % by][col % bx]
+    return value
+
+#########################################################################################################
+# Read a DDF look-up table into a list of Dictionary elements, as csv.DictReader gives them, with the damage
+# percentages at each depth (m4 .. p24) converted to float once here rather than at every interpolation.
+#########################################################################################################
+DDF_DEPTHS = ['m4','m3','m2','m1'] + ['p' + str(i) for i in range(25)]
+def read_ddf_lut(path):
+    with open(path) as f:
+        lut = [row for row in csv.DictReader(f)]
+    for row in lut:
+        for col in DDF_DEPTHS: row[col] = float(row[col])
+    return lut
+
 #########################################################################################################
 # Main function. Five parameters See end for main procedure.
 #########################################################################################################
@@ -83,7 +114,11 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
     
     
         #Get field names
-        with open(UDFOrig, "r+") as f:
+        # utf-8-sig only for a file that starts with a byte order mark, as the GUI reads the header; other files
+        # (e.g. code-page exports) keep the default encoding
+        with open(UDFOrig, 'rb') as f:
+            encoding = 'utf-8-sig' if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else None
+        with open(UDFOrig, "r+", encoding=encoding) as f:
             reader = csv.reader(f)
             field_names = next(reader)
         #########################################################################################################
@@ -191,18 +226,18 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
         # Process the look-up tables into a list of Dictionary elements
         # Note the standard (default) Lookup Tables were separately developed.
         # Yes, they are a subset of the full lookup table
-        bddf_lut_riverine     = [row for row in csv.DictReader(open(BRP))]
-        bddf_lut_coastalA     = [row for row in csv.DictReader(open(BCAP))]
-        bddf_lut_coastalV     = [row for row in csv.DictReader(open(BCVP))]
-        bddf_lut_full         = [row for row in csv.DictReader(open(BFP))]
+        bddf_lut_riverine     = read_ddf_lut(BRP)
+        bddf_lut_coastalA     = read_ddf_lut(BCAP)
+        bddf_lut_coastalV     = read_ddf_lut(BCVP)
+        bddf_lut_full         = read_ddf_lut(BFP)
     
-        cddf_lut_riverine     = [row for row in csv.DictReader(open(CRP))]
-        cddf_lut_coastalA     = [row for row in csv.DictReader(open(CCAP))]
-        cddf_lut_coastalV     = [row for row in csv.DictReader(open(CCVP))]
-        cddf_lut_full         = [row for row in csv.DictReader(open(CFP))]
+        cddf_lut_riverine     = read_ddf_lut(CRP)
+        cddf_lut_coastalA     = read_ddf_lut(CCAP)
+        cddf_lut_coastalV     = read_ddf_lut(CCVP)
+        cddf_lut_full         = read_ddf_lut(CFP)
     
-        iddf_lut_riverine     = [row for row in csv.DictReader(open(IRP))]
-        iddf_lut_full         = [row for row in csv.DictReader(open(IFP))]
+        iddf_lut_riverine     = read_ddf_lut(IRP)
+        iddf_lut_full         = read_ddf_lut(IFP)
         iecon_lut            = [row for row in csv.DictReader(open(IEP))]
     
         debris_lut            = [row for row in csv.DictReader(open(Debris))]
@@ -300,20 +335,18 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
     
             file_out = open(os.path.join(Resultsfgdb,x+".csv"), 'w')
             
-            raster = gdal.Open(dgp)
+            raster = gdal.OpenEx(dgp, gdal.OF_RASTER | gdal.OF_READONLY)# Opened once per grid; only raster drivers are probed
             
             #os.sys('gdalwarp '+dgp+' '+' C:/Users/Owner/Desktop/work.tif -t_srs "+proj=longlat +ellps=WGS84"')
             
             band = raster.GetRasterBand(1)
-            cols = raster.RasterXSize
-            rows = raster.RasterYSize
             transform = raster.GetGeoTransform()
             print('Transform = ', transform)
             xOrigin = transform[0]
             yOrigin = transform[3]
             pixelWidth = transform[1]
             pixelHeight = -transform[5]
-            data = band.ReadAsArray(0, 0, cols, rows)#gdal_array.LoadFile(dgp)
+            depth_at = raster_blocks(band)#gdal_array.LoadFile(dgp)
             IsUTM = True if osr.SpatialReference(wkt=raster.GetProjection()).GetAttrValue('UNIT') == 'metre' else False
             print('Is it UTM? ', IsUTM)
             
@@ -347,7 +380,7 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
                 data_array = np.array(data_source.GetRasterBand(1).ReadAsArray())
                 return data_array[pixel_coord[0]][pixel_coord[1]]
             """
-            with open(UDFOrig, newline='') as csvfile:
+            with open(UDFOrig, newline='', encoding=encoding) as csvfile:
                 writer = csv.DictWriter(file_out, delimiter=',', lineterminator='\n', fieldnames = field_names)
                 file = csv.DictReader(csvfile)
                 for row in file:
@@ -368,7 +401,7 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
                                 col = int((X - xOrigin) / pixelWidth)
                                 roww = int((yOrigin - Y ) / pixelHeight)
                                 
-                                val = data[roww][col]
+                                val = depth_at(roww, col)
                                 #val = retrieve_pixel_value((Y,X))
                                 
                                 row[name] = val
@@ -562,8 +595,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
                                         if OccClsCheck != OC and QC_Warning:
                                             print("FYI: User-supplied Building DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
                                         break
-                                d_lower = float(ddf1[l_index])
-                                d_upper = float(ddf1[u_index])
+                                d_lower = ddf1[l_index]
+                                d_upper = ddf1[u_index]
                                 ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
         
                             else:
@@ -602,8 +635,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
         
                             # Dictionary lookup: get damage percentage for the particular row at the particular depths
                             # The Dictionary element comes from either the Full or the Default table; common code after this point.
-                            d_lower = float(ddf1[l_index])
-                            d_upper = float(ddf1[u_index])
+                            d_lower = ddf1[l_index]
+                            d_upper = ddf1[u_index]
                             # Get fractional amount of depth, for interpolation
                             frac = depth - math.floor(depth)
                             damage = (d_lower + frac*(d_upper - d_lower))/100
@@ -646,8 +679,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
                                         if OccClsCheck != OC and QC_Warning:
                                             print("FYI: User-supplied Content  DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
                                         break
-                                d_lower = float(ddf1[l_index])
-                                d_upper = float(ddf1[u_index])
+                                d_lower = ddf1[l_index]
+                                d_upper = ddf1[u_index]
                                 ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
         
                             else:
@@ -684,8 +717,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
         
                             # Dictionary lookup: get damage percentage for the particular row at the particular depths
                             # The Dictionary element comes from either the Full or the Default table; common code after this point.
-                            d_lower = float(ddf1[l_index])
-                            d_upper = float(ddf1[u_index])
+                            d_lower = ddf1[l_index]
+                            d_upper = ddf1[u_index]
                             # Get fractional amount of depth, for interpolation
                             frac = depth - math.floor(depth)
                             damage = (d_lower + frac*(d_upper - d_lower))/100
@@ -725,8 +758,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
                                         if OccClsCheck != OC and QC_Warning:
                                             print("FYI: User-supplied Inventory DDFID " + BID + " Occupancy Class is inconsistent with UDF Occupancy Class " + OC + " versus "+OccClsCheck+ "  " + userDefinedFltyId)
                                         break
-                                d_lower = float(ddf1[l_index])
-                                d_upper = float(ddf1[u_index])
+                                d_lower = ddf1[l_index]
+                                d_upper = ddf1[u_index]
                                 frac = depth - math.floor(depth)
                                 damage = (d_lower + frac*(d_upper - d_lower))/100
                                 ddf_id = int(BID)  # Yes, it is redundant to post, again, what the user specified. But it is consistent with Default LUT
@@ -760,8 +793,8 @@ def flood_damage(UDFOrig, LUT_Dir, ResultsDir, DepthGrids, QC_Warning, fmap):
         
                                     # Dictionary lookup: get damage percentage for the particular row at the particular depths
                                     # The Dictionary element comes from either the Full or the Default table; common code after this point.
-                                    d_lower = float(ddf1[l_index])
-                                    d_upper = float(ddf1[u_index])
+                                    d_lower = ddf1[l_index]
+                                    d_upper = ddf1[u_index]
                                     # Get fractional amount of depth, for interpolation
                                     frac = depth - math.floor(depth)
                                     damage = (d_lower + frac*(d_upper - d_lower))/100
@@ -1,24 +1,63 @@
-import os, csv
+import os, csv, logging, codecs
 
 dir = os.getcwd()
 #dir = os.path.dirname(dir)
+logger = logging.getLogger(__name__)# Progress at INFO, file and field names at DEBUG; the caller decides what is shown
+
+DDFAssign = ['SOoccupId_Occ_Xref','flBldgStructDmgFinal','flBldgContDmgFinal','flBldgInvDmgFinal','OccupancyTypes']
+DDFDefault = ['flBldgStructDmgFn_DDF','flBldgContDmgFn_DDF','flBldgInvDmgFn_DDF']
+LUT_Dir = os.path.join(dir,'lookuptables')
+LUT_Paths = {DDF:os.path.join(LUT_Dir,DDF+'.csv') for DDF in DDFAssign + DDFDefault}# Joined once, at import
+
+def index_xref(xref):# Group the cross-reference rows by (Occupancy, Basement), keeping table order for the story ranges
+    index = {}
+    for line in xref:
+        try:
+            basement = int(line['Basement'])
+        except (ValueError, TypeError):# A blank or non-numeric basement flag would match no building: skip the row rather than stop the run
+            logger.warning("SOoccupId_Occ_Xref row for %s skipped: Basement %r is not a number", line['SOccupId'].strip(), line['Basement'])
+            continue
+        index.setdefault((line['Occupancy'].strip(), basement), []).append((line['NumStoriesInt'], line['SOccupId'].strip()))
+    return index
+
+def find_soid(candidates, stories):# SOccupId whose story range covers stories; 0 if none matches
+    for compare, soid in candidates:
+        if len(compare) > 1:
+            if '-' in compare:
+                if int(compare[0]) <= int(stories) <= int(compare[-1]): return soid
+            elif '>' in compare:
+                if int(stories) > int(compare[1]): return soid
+            elif '<' in compare:
+                if int(stories) < int(compare[1]): return soid
+        elif len(compare) == 1 and int(compare) == int(stories):
+            return soid
+    return 0
+
+def index_ddf(table, id_field, HazardType):# SOccupId -> DDF ID, for the rows that apply to the hazard type. First row wins
+    if table and HazardType not in table[0]:# Checked once here, so a wrong hazard type names the column rather than failing on the first row
+        raise ValueError("the %s look-up table has no hazard type column %r" % (id_field, HazardType))
+    index = {}
+    for line in table:
+        try:
+            if int(line[HazardType]) != 1: continue
+        except (ValueError, TypeError):# Blank or non-numeric hazard cell, or missing from a short row: the row does not apply
+            continue
+        index.setdefault(line['SOccupId'].strip(), line[id_field])
+    return index
 
 def process(input,fmap):
     try:
-        output = input.split('.')[0]+'_pre_processed.csv'
-        print(output)
+        output = os.path.splitext(input)[0]+'_pre_processed.csv'
+        logger.debug("output %s", output)
         OCC,NumStories,foundationtype,SOID,BDDF_ID,CDDF_ID,IDDF_ID,HazardType = fmap
         SOID = SOID if SOID != '' else 'SOID'
         BDDF_ID = BDDF_ID if BDDF_ID != '' else 'BDDF_ID'
         CDDF_ID = CDDF_ID if CDDF_ID != '' else 'CDDF_ID'
         IDDF_ID = IDDF_ID if IDDF_ID != '' else 'IDDF_ID'
         
-        LUT_Dir = os.path.join(dir,'lookuptables')
-        
-        DDFAssign = ['SOoccupId_Occ_Xref','flBldgStructDmgFinal','flBldgContDmgFinal','flBldgInvDmgFinal','OccupancyTypes']
         DDFTables = {}
         for DDF in DDFAssign:
-            with open(os.path.join(LUT_Dir,DDF+'.csv'), newline='') as csvfile:
+            with open(LUT_Paths[DDF], newline='') as csvfile:
                 file = csv.DictReader(csvfile)
                 DDFTable = [row for row in file]
                 DDFTables[DDF] = DDFTable
@@ -28,134 +67,114 @@ def process(input,fmap):
         countie3 = [0,0,0,0]
         counter = 0
         counter2 = 0
+        # Index the look-up tables once, so each row takes a few dict look-ups rather than a scan of every table
+        xref = index_xref(DDFTables['SOoccupId_Occ_Xref'])
+        bddfs = index_ddf(DDFTables['flBldgStructDmgFinal'], 'BldgDmgFnId', HazardType)
+        cddfs = index_ddf(DDFTables['flBldgContDmgFinal'], 'ContDmgFnId', HazardType)
+        iddfs = index_ddf(DDFTables['flBldgInvDmgFinal'], 'InvDmgFnId', HazardType)
+        soids = {}# (Occupancy, NumStories, basement) -> SOccupId, worked out once per distinct key
 
-        DDFDefault = ['flBldgStructDmgFn_DDF','flBldgContDmgFn_DDF','flBldgInvDmgFn_DDF']
         DDFDefaultTables = {}
         for DDF in DDFDefault:
-            with open(os.path.join(LUT_Dir,DDF+'.csv'), newline='') as csvfile:
+            with open(LUT_Paths[DDF], newline='') as csvfile:
                 file = csv.DictReader(csvfile)
-                DDFDefaultTable = [list(row.values())[0] for row in file]
-                DDFDefaultTables[DDF] = DDFDefaultTable
-
-        with open(input, "r+") as f:
-            reader = csv.reader(f)
-            field_names = next(reader)
+                id_field = file.fieldnames[0]
+                DDFDefaultTables[DDF] = set(row[id_field].strip() for row in file)# Stripped once here; checked with a set look-up per row
 
-        with open(input, newline='') as csvfile:
-            field_names = field_names + [field for field in [SOID,BDDF_ID,CDDF_ID,IDDF_ID] if field not in field_names]
+        with open(input, 'rb') as f:# Drop the byte order mark Excel writes; a file without one is read with the default encoding, as before
+            encoding = 'utf-8-sig' if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else None
+        # One pass over the input; rows are written out as they are read
+        with open(input, newline='', encoding=encoding) as csvfile, open(output, 'w', buffering=1<<20) as outfile:
+            file = csv.reader(csvfile)
+            header = next(file)
+            field_names = header + [field for field in [SOID,BDDF_ID,CDDF_ID,IDDF_ID] if field not in header]
             field_names.append('DDF_Validity')
-            print(field_names)
-            writer = csv.DictWriter(open(output, 'w'), delimiter=',', lineterminator='\n', fieldnames = field_names)
-            file = csv.DictReader(csvfile)
+            logger.debug("fields %s", field_names)
+            # Rows are lists, read and written by column position. A column added to the output, or missing from the end of a short row, is None
+            col = {name:i for i, name in enumerate(field_names)}# As DictReader, the last of any duplicate names wins
+            occ_i, ns_i, fnd_i = col[OCC], col[NumStories], col[foundationtype]
+            soid_i, bddf_i, cddf_i, iddf_i, valid_i = col[SOID], col[BDDF_ID], col[CDDF_ID], col[IDDF_ID], col['DDF_Validity']
+            ncells, width = len(header), len(field_names)
+            writer = csv.writer(outfile, delimiter=',', lineterminator='\n')
+            writer.writerow(field_names)
             for row in file:
+                if not row: continue# Blank line, skipped as DictReader does
+                if len(row) > ncells:# Cells past the header have no column; left in, they would land in the added ID columns
+                    logger.warning("record %d has %d cells for %d columns; the extra cells are dropped", counter2 + 1, len(row), ncells)
+                    row = row[:ncells]
+                if len(row) < width: row += [None] * (width - len(row))
                 try:
                     value = 0
-                    basement = 1 if int(row[foundationtype]) == 4 else 0
-                    if row.get(SOID) == None and SOID != '':
-                        for line in DDFTables['SOoccupId_Occ_Xref']:
-                            compare = line['NumStoriesInt']
-                            if len(compare) > 1 and int(line['Basement']) == basement and line['Occupancy'].strip() == row[OCC]:
-                                if '-' in compare:
-                                    if int(compare[0]) <= int(row[NumStories]) <= int(compare[-1]):
-                                        value = line['SOccupId'].strip()
-                                        row[SOID] = value
-                                        countie[0] = countie[0] + 1
-                                        row['DDF_Validity'] = None
-                                        break
-                                elif '>' in compare:
-                                    if int(row[NumStories]) > int(compare[1]):
-                                        value = line['SOccupId'].strip()
-                                        row[SOID] = value
-                                        countie[0] = countie[0] + 1
-                                        row['DDF_Validity'] = None
-                                        break
-                                elif '<' in compare:
-                                    if int(row[NumStories]) < int(compare[1]):
-                                        value = line['SOccupId'].strip()
-                                        row[SOID] = value
-                                        countie[0] = countie[0] + 1
-                                        row['DDF_Validity'] = None
-                                        break
-                            elif len(compare) == 1 and line['Occupancy'].strip() == row[OCC] and int(compare) == int(row[NumStories]) and int(line['Basement']) == basement:
-                                value = line['SOccupId'].strip()
-                                row[SOID] = value
-                                countie[0] = countie[0] + 1
-                                row['DDF_Validity'] = None
-                                break
-                            
-                            
-                   
+                    basement = 1 if int(row[fnd_i]) == 4 else 0
+                    if row[soid_i] is None and SOID != '':
+                        key = (row[occ_i], row[ns_i], basement)
+                        if key not in soids: soids[key] = find_soid(xref.get((row[occ_i], basement), ()), row[ns_i])
+                        value = soids[key]
+                        if value != 0:
+                            row[soid_i] = value
+                            countie[0] = countie[0] + 1
+                            row[valid_i] = None
                                 
-                    if row.get(BDDF_ID) == None and BDDF_ID != '':
-                        for line in DDFTables['flBldgStructDmgFinal']:
-                            if line['SOccupId'].strip() == value and int(line[HazardType]) == 1:
-                                row[BDDF_ID] = line['BldgDmgFnId']
-                                countie[1] = countie[1] + 1
-                                row['DDF_Validity'] = None
-                                break
+                    if row[bddf_i] is None and BDDF_ID != '':
+                        if value in bddfs:
+                            row[bddf_i] = bddfs[value]
+                            countie[1] = countie[1] + 1
+                            row[valid_i] = None
                             
-                    elif row.get(BDDF_ID) != None and BDDF_ID != '':
+                    elif row[bddf_i] is not None and BDDF_ID != '':
                         countie3[1] += 1
-                        default = row[BDDF_ID].strip()
-                        row[BDDF_ID] = None
+                        default = row[bddf_i].strip()
+                        row[bddf_i] = None
                         if default in DDFDefaultTables['flBldgStructDmgFn_DDF']:
-                            row[BDDF_ID] = default
+                            row[bddf_i] = default
                             countie2[1] = countie2[1] + 1
-                            row['DDF_Validity'] = None
+                            row[valid_i] = None
                             
                         
-                    if row.get(CDDF_ID) == None and CDDF_ID != '':    
-                        for line in DDFTables['flBldgContDmgFinal']:
-                            if line['SOccupId'].strip() == value and int(line[HazardType]) == 1:
-                                row[CDDF_ID] = line['ContDmgFnId']
-                                countie[2] = countie[2] + 1
-                                row['DDF_Validity'] = None
-                                break
+                    if row[cddf_i] is None and CDDF_ID != '':    
+                        if value in cddfs:
+                            row[cddf_i] = cddfs[value]
+                            countie[2] = countie[2] + 1
+                            row[valid_i] = None
                             
-                    elif row.get(CDDF_ID) != None and CDDF_ID != '':
+                    elif row[cddf_i] is not None and CDDF_ID != '':
                         countie3[2] += 1
-                        default = row[CDDF_ID].strip()
-                        row[CDDF_ID] = None
+                        default = row[cddf_i].strip()
+                        row[cddf_i] = None
                         if default in DDFDefaultTables['flBldgContDmgFn_DDF']:
-                            row[BDDF_ID] = default
+                            row[bddf_i] = default
                             countie2[1] = countie2[1] + 1
-                            row['DDF_Validity'] = None
+                            row[valid_i] = None
                             
-                    if row.get(IDDF_ID) == None and IDDF_ID != '':   
-                        for line in DDFTables['flBldgInvDmgFinal']:
-                            if line['SOccupId'].strip() == value and int(line[HazardType]) == 1:
-                                row[IDDF_ID] = line['InvDmgFnId']
-                                countie[3] = countie[3] + 1
-                                row['DDF_Validity'] = None
-                                break
+                    if row[iddf_i] is None and IDDF_ID != '':   
+                        if value in iddfs:
+                            row[iddf_i] = iddfs[value]
+                            countie[3] = countie[3] + 1
+                            row[valid_i] = None
                             
-                    elif row.get(IDDF_ID) != None and IDDF_ID != '':
+                    elif row[iddf_i] is not None and IDDF_ID != '':
                         countie3[3] += 1
-                        default = row[IDDF_ID].strip()
-                        row[IDDF_ID] = None
+                        default = row[iddf_i].strip()
+                        row[iddf_i] = None
                         if default in DDFDefaultTables['flBldgInvDmgFn_DDF']:
-                            row[BDDF_ID] = default
+                            row[bddf_i] = default
                             countie2[1] = countie2[1] + 1
-                            row['DDF_Validity'] = None
+                            row[valid_i] = None
                         
                         
                     counter += 1
                     counter2 += 1
-                    if counter % 10000 == 0:
-                        print( "   processing record " + str(counter),  ' countie = ', countie, ' countie2 = ', countie2)
+                    if counter % 100000 == 0:
+                        logger.info("   processing record %d countie = %s countie2 = %s", counter, countie, countie2)
                         
-                    if counter == 1:
-                        writer.writeheader()
-                        writer.writerow(row)
-                        continue
                     writer.writerow(row)
                 except Exception as e:
                     writer.writerow(row)
                     counter2 += 1
-                    print(e)
+                    logger.warning("record %d written unprocessed: %s", counter2, e)
                     continue
-            print("Total records processed: " + str(counter),  ' countie = ', countie, ' countie2 = ', countie2)
+            logger.info("Total records processed: %d countie = %s countie2 = %s", counter, countie, countie2)
             return(True, [counter,counter2], countie, countie2, countie3)
     except Exception as e:
-        print(e)
+        logger.error(e)
         return(False, counter, countie, countie2)
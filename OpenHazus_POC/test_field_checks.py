@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+import field_checks
+
+FIELDS = {'OCC':'Occupancy*','SOID':'SpecificOcc_ID','HazardType':'Hazard-Type*'}
+DEFAULTS = field_checks.normalize_defaults({'OCC':['Occupancy','Occ'],'SOID':['SpecificOcc_ID','SOID']})
+
+class Box:# Stands in for a Tk Entry or Listbox: a text value and a selection, and the options it was last given
+    def __init__(self, value=''):
+        self.value, self.options = value, {}
+    def get(self, index=None):
+        return self.value
+    def curselection(self):
+        return (0,)
+    def config(self, **options):
+        self.options.update(options)
+
+def make_root(csvFields):
+    root = SimpleNamespace(idle=[])
+    field_checks.init_form(root, FIELDS, DEFAULTS, {'Hazard-Type*':{'CoastalA':'HazardCA'}})
+    root.csvFields, root.csvFieldsLower = csvFields, field_checks.header_map(csvFields)
+    root.ents = {'Occupancy*':Box(), 'SpecificOcc_ID':Box(), 'Hazard-Type*':Box('CoastalA')}
+    root.vars = {field:ent for field, ent in root.ents.items() if field != 'Hazard-Type*'}
+    root.runButton, root.runCommand = Box(), 'run'
+    root.after_idle = lambda func, *args: root.idle.append((func, args))
+    return root
+
+def test_checkform_maps_defaults_and_enables_run():
+    root = make_root([' occ ', 'Cost'])
+    field_checks.checkform(root)
+    assert root.fields == {'OCC':' occ ', 'SOID':'', 'HazardType':'HazardCA'}
+    assert root.invalid == 0
+    assert root.ents['Occupancy*'].options == {'background':'green'}
+    assert root.ents['SpecificOcc_ID'].options == {'background':'yellow'}
+    assert root.runButton.options == {'fg':'black', 'command':'run'}
+
+def test_changes_are_checked_once_when_idle():
+    root = make_root(['Occ', 'Cost'])
+    field_checks.checkform(root)
+    root.ents['Occupancy*'].value = 'cost'
+    field_checks.schedule_check(root, 'OCC')
+    root.ents['Occupancy*'].value = 'missing'
+    field_checks.schedule_check(root, 'OCC')
+    assert len(root.idle) == 1 and root.fields['OCC'] == 'Occ'
+    func, args = root.idle.pop()
+    func(*args)
+    assert root.fields['OCC'] == '' and root.invalid == 1 and root.pending == set()
+    assert root.ents['Occupancy*'].options['background'] == 'red'
+    assert root.runButton.options == {'fg':'grey', 'command':''}
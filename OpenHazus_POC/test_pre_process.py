@@ -0,0 +1,70 @@
+import csv, logging
+import pytest
+import pre_process
+
+LUTS = {
+    'SOoccupId_Occ_Xref': [['Occupancy','NumStoriesInt','Basement','SOccupId'], [' RES1 ','1','0',' S001 '], [' RES1 ','2','',' S002 '], [' RES1 ','2','0',' S003 '], [' RES1 ','1','1',' S004 ']],
+    'flBldgStructDmgFinal': [['SOccupId','BldgDmgFnId','HazardR','HazardCA'], [' S001','101','1','0'], [' S003','103','1','1'], [' S004','104','1','0']],
+    'flBldgContDmgFinal': [['SOccupId','ContDmgFnId','HazardR','HazardCA'], [' S001','201','1','0'], [' S003','203','0','1']],
+    'flBldgInvDmgFinal': [['SOccupId','InvDmgFnId','HazardR','HazardCA'], [' S001','301','1','0']],
+    'OccupancyTypes': [['Occupancy'], ['RES1']],
+    'flBldgStructDmgFn_DDF': [['DDF_ID'], ['101'], ['105']],
+    'flBldgContDmgFn_DDF': [['DDF_ID'], ['201']],
+    'flBldgInvDmgFn_DDF': [['DDF_ID'], ['301']],
+}
+FMAP = ['Occ','NumStories','FoundationType','SOID','BDDF_ID','CDDF_ID','IDDF_ID','HazardR']
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+def read_dicts(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+@pytest.fixture
+def luts(tmp_path, monkeypatch):# Small look-up tables in place of the lookuptables folder
+    paths = {}
+    for name, rows in LUTS.items():
+        paths[name] = str(tmp_path / (name + '.csv'))
+        write_csv(paths[name], rows)
+    monkeypatch.setattr(pre_process, 'LUT_Paths', paths)
+    return tmp_path
+
+def run(tmp_path, rows, fmap=FMAP):
+    path = tmp_path / 'inventory.csv'
+    write_csv(path, rows)
+    result = pre_process.process(str(path), fmap)
+    return result, read_csv(tmp_path / 'inventory_pre_processed.csv')
+
+def test_xref_row_without_basement_is_skipped(luts, caplog):
+    with caplog.at_level(logging.WARNING, logger='pre_process'):
+        index = pre_process.index_xref(read_dicts(pre_process.LUT_Paths['SOoccupId_Occ_Xref']))
+    assert index == {('RES1', 0): [('1', 'S001'), ('2', 'S003')], ('RES1', 1): [('1', 'S004')]}
+    assert "S002 skipped: Basement '' is not a number" in caplog.text
+
+def test_process_runs_past_blank_basement(luts):
+    result, out = run(luts, [['Occ','NumStories','FoundationType'], ['RES1','2','7'], ['RES1','1','4']])
+    assert result[0] is True
+    assert out[1:] == [['RES1','2','7','S003','103','','',''], ['RES1','1','4','S004','104','','','']]
+
+def test_missing_hazard_column_is_reported(luts, caplog):
+    with pytest.raises(ValueError, match="BldgDmgFnId look-up table has no hazard type column 'HazardX'"):
+        pre_process.index_ddf([{'SOccupId':'S001', 'BldgDmgFnId':'101', 'HazardR':'1'}], 'BldgDmgFnId', 'HazardX')
+    with caplog.at_level(logging.ERROR, logger='pre_process'):
+        result = pre_process.process(str(luts / 'inventory.csv'), FMAP[:-1] + ['HazardX'])
+    assert result[0] is False
+    assert "no hazard type column 'HazardX'" in caplog.text
+
+def test_overlong_row_is_cut_to_header(luts, caplog):
+    with caplog.at_level(logging.WARNING, logger='pre_process'):
+        result, out = run(luts, [['Occ','NumStories','FoundationType'], ['RES1','1','7','x1','x2','x3','x4','x5','x6'], ['RES1','1','4']])
+    assert result[0] is True
+    assert out == [['Occ','NumStories','FoundationType','SOID','BDDF_ID','CDDF_ID','IDDF_ID','DDF_Validity'],
+                   ['RES1','1','7','S001','101','201','301',''],
+                   ['RES1','1','4','S004','104','','','']]
+    assert "record 1 has 9 cells for 3 columns" in caplog.text